@@ -1,5 +1,7 @@
 """This module contains configuration constants used across the framework"""
 
+import os
+
 # The number of times the robot retries on an error before terminating.
 MAX_RETRY_COUNT = 3
 
@@ -10,6 +12,41 @@ FAIL_ROBOT_ON_TOO_MANY_ERRORS = True
 SMTP_SERVER = "smtp.adm.aarhuskommune.dk"
 SMTP_PORT = 25
 SCREENSHOT_SENDER = "robot@friend.dk"
+# Screenshots are downscaled to this width and sent as JPEG. A screenshot larger than the cap (bytes) is left out
+ERROR_SCREENSHOT_MAX_WIDTH = 1280
+ERROR_SCREENSHOT_MAX_BYTES = 500 * 1024
+# Error reports are sent in the background. The same error is reported once per ERROR_REPORT_DEDUPE_SECONDS,
+# and at most ERROR_REPORT_MAX_PENDING reports wait to be sent. Waiting reports are sent before the robot closes,
+# for at most ERROR_REPORT_FLUSH_TIMEOUT seconds
+ERROR_REPORT_DEDUPE_SECONDS = 10 * 60
+ERROR_REPORT_MAX_PENDING = 20
+ERROR_REPORT_FLUSH_TIMEOUT = 60
+ERROR_REPORT_SMTP_TIMEOUT = 30
+
+# Notification e-mails are sent over one SMTP session for the run.
+# An idle session is checked with NOOP before reuse, and a message is resent on a new session if the old one was dropped
+SMTP_HEALTH_CHECK_INTERVAL = 60
+SMTP_SEND_ATTEMPTS = 2
+
+# Database config
+# Idle pooled connections older than this (seconds) are health checked before reuse
+DB_HEALTH_CHECK_INTERVAL = 60
+# Number of rows fetched per round trip when streaming query results
+DB_FETCH_ARRAYSIZE = 5000
+# SQL Server accepts at most 2100 parameters per statement
+DB_MAX_PARAMETERS = 2000
+# Key lists are bulk loaded into session temp tables. If not allowed, they are sent as chunked IN lists
+DB_USE_TEMP_TABLES = True
+DB_IN_LIST_CHUNK_SIZE = 500
+# Maximum number of independent queries run at the same time by fetch_concurrently
+DB_MAX_CONCURRENT_QUERIES = 4
+
+# Reference data (LIS/SD/AF lookups) is cached for the run. Entries expire after the TTL (seconds)
+REFERENCE_CACHE_TTL = 3600
+REFERENCE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Orchestrator constants and credentials are cached for the run. Entries expire after the TTL (seconds)
+ORCHESTRATOR_CACHE_TTL = 600
 
 # Constant/Credential names
 ERROR_EMAIL = "Error Email"
@@ -17,6 +54,24 @@ ERROR_EMAIL = "Error Email"
 SERVICE_NOW_API_DEV_USER = "service_now_dev_user"
 SERVICE_NOW_API_PROD_USER = "service_now_prod_user"
 
+# ServiceNow incidents are created on the production instance if True, otherwise on the test instance
+SERVICE_NOW_USE_PROD = False
+# Overrides the instance URL if set, e.g. "http://localhost:8080" for a local stand-in
+SERVICE_NOW_BASE_URL = None
+# Connect and read timeouts (seconds) of ServiceNow requests
+SERVICE_NOW_TIMEOUT = (5, 30)
+# Requests answered with 429/502/503/504 or failing to connect are retried this many times, with exponential backoff
+SERVICE_NOW_RETRIES = 3
+SERVICE_NOW_BACKOFF_FACTOR = 1
+# Maximum number of ServiceNow requests sent at the same time, e.g. when the batch API is not available
+SERVICE_NOW_MAX_CONCURRENT_REQUESTS = 4
+
+# ServiceNow cases (notification type "ServiceNow case") are created in this table, SERVICE_NOW_CASE_BATCH_SIZE
+# per batch API call. Open cases are listed SERVICE_NOW_CASE_PAGE_SIZE at a time to avoid duplicates
+SERVICE_NOW_CASE_TABLE = "incident"
+SERVICE_NOW_CASE_BATCH_SIZE = 50
+SERVICE_NOW_CASE_PAGE_SIZE = 1000
+
 # Queue specific configs
 # ----------------------
 
@@ -26,5 +81,49 @@ QUEUE_NAME = "per.sdloen"  # Specific queue name added by process arguments
 # The limit on how many queue elements to process
 MAX_TASK_COUNT = 100
 
+# Page size when listing the references already in a queue
+QUEUE_REFERENCE_PAGE_SIZE = 1000
+
+# Number of queue elements processed at the same time
+QUEUE_WORKER_COUNT = 4
+
+# Length of the data column of a queue element in OpenOrchestrator. Digests longer than this are split into parts
+QUEUE_DATA_MAX_LENGTH = 2000
+
 # ----------------------
 TEMP_PATH = R"C:\SDLøn"
+
+# Local snapshot of reference data, shared by the trigger runs on this machine.
+# Snapshots checked within SNAPSHOT_FRESH_SECONDS are used as is. Older snapshots are validated
+# against a fingerprint from the server, and reloaded when older than SNAPSHOT_MAX_AGE
+SNAPSHOT_DB_PATH = os.path.join(TEMP_PATH, "reference_snapshots.sqlite")
+SNAPSHOT_FRESH_SECONDS = 15 * 60
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+SNAPSHOT_MMAP_SIZE = 256 * 1024 * 1024
+
+# Queue elements are claimed QUEUE_LEASE_SIZE at a time, and their statuses are written in batches of
+# QUEUE_STATUS_BATCH_SIZE or every QUEUE_CHECKPOINT_INTERVAL seconds. A local journal lets the next run
+# recover elements of a run that stopped before its checkpoint, once the journal is QUEUE_LEASE_TIMEOUT seconds old
+QUEUE_LEASE_SIZE = 10
+QUEUE_STATUS_BATCH_SIZE = 20
+QUEUE_CHECKPOINT_INTERVAL = 30
+QUEUE_LEASE_TIMEOUT = 60 * 60
+QUEUE_JOURNAL_DIR = os.path.join(TEMP_PATH, "queue_journal")
+
+# Local ledger of notified findings. A finding is not notified again within NOTIFICATION_SUPPRESSION_SECONDS.
+# From the NOTIFICATION_ESCALATE_AFTER'th notification it is marked as a reminder. A finding not found for
+# NOTIFICATION_RESOLVED_SECONDS is considered fixed. Entries are kept for NOTIFICATION_LEDGER_RETENTION seconds
+NOTIFICATION_LEDGER_ENABLED = True
+NOTIFICATION_LEDGER_PATH = os.path.join(TEMP_PATH, "notification_ledger.sqlite")
+NOTIFICATION_SUPPRESSION_SECONDS = 7 * 24 * 60 * 60
+NOTIFICATION_ESCALATE_AFTER = 3
+NOTIFICATION_RESOLVED_SECONDS = 2 * 24 * 60 * 60
+NOTIFICATION_LEDGER_RETENTION = 90 * 24 * 60 * 60
+
+# Incremental mode keeps the active employments locally and only fetches the changed ones.
+# Everything is reloaded when the local copy is older than INCREMENTAL_FULL_REFRESH_SECONDS
+INCREMENTAL_DIR = os.path.join(TEMP_PATH, "incremental")
+INCREMENTAL_FULL_REFRESH_SECONDS = 24 * 60 * 60
+
+# The sys_id of the open ServiceNow incident of each process is kept locally, so it can be fetched by key
+INCIDENT_CACHE_PATH = os.path.join(TEMP_PATH, "servicenow_incidents.sqlite")
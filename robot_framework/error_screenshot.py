@@ -6,12 +6,13 @@ import base64
 import traceback
 from io import BytesIO
 
-from PIL import ImageGrab
+from PIL import Image, ImageGrab
 
 from robot_framework import config
 
 
-def send_error_screenshot(to_address: str | list[str], exception: Exception, process_name: str):
+def send_error_screenshot(to_address: str | list[str], exception: Exception, process_name: str, trace: str | None = None,
+                          screen: Image.Image | None = None):
     """Sends an email with an error report, including a screenshot, when an exception occurs.
     Configuration details such as SMTP server, port, sender email, etc., should be set in 'config' module.
 
@@ -19,6 +20,8 @@ def send_error_screenshot(to_address: str | list[str], exception: Exception, pro
         to_address: Email address or list of addresses to send the error report.
         exception: The exception that triggered the error.
         process_name: Name of the process from OpenOrchestrator.
+        trace: The traceback of the exception. Must be given when called outside the except block.
+        screen: The screen when the error occurred, see grab_screen. Without it the report has no screenshot.
     """
     # Create message
     msg = EmailMessage()
@@ -26,11 +29,12 @@ def send_error_screenshot(to_address: str | list[str], exception: Exception, pro
     msg['from'] = config.SCREENSHOT_SENDER
     msg['subject'] = f"Error screenshot: {process_name}"
 
-    # Take screenshot and convert to base64
-    screenshot = ImageGrab.grab()
-    buffer = BytesIO()
-    screenshot.save(buffer, format='PNG')
-    screenshot_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    # Compress the screenshot and convert to base64. Hosts without a screen send the report without it
+    screenshot = encode_screenshot(screen) if screen is not None else None
+    if screenshot:
+        screenshot_html = f'<img src="data:image/jpeg;base64,{base64.b64encode(screenshot).decode("utf-8")}" alt="Screenshot">'
+    else:
+        screenshot_html = "<p>No screenshot available.</p>"
 
     # Create an HTML message with the exception and screenshot
     html_message = f"""
@@ -38,8 +42,8 @@ def send_error_screenshot(to_address: str | list[str], exception: Exception, pro
         <body>
             <p>Error type: {type(exception).__name__}</p>
             <p>Error message: {exception}</p>
-            <p>{traceback.format_exc()}</p>
-            <img src="data:image/png;base64,{screenshot_base64}" alt="Screenshot">
+            <p>{trace if trace is not None else traceback.format_exc()}</p>
+            {screenshot_html}
         </body>
     </html>
     """
@@ -48,6 +52,39 @@ def send_error_screenshot(to_address: str | list[str], exception: Exception, pro
     msg.add_alternative(html_message, subtype='html')
 
     # Send message
-    with smtplib.SMTP(config.SMTP_SERVER, config.SMTP_PORT) as smtp:
+    with smtplib.SMTP(config.SMTP_SERVER, config.SMTP_PORT, timeout=config.ERROR_REPORT_SMTP_TIMEOUT) as smtp:
         smtp.starttls()
         smtp.send_message(msg)
+
+
+def grab_screen():
+    """Grab the screen. Must be called when the error occurs, so the report shows the screen at the error.
+
+    Returns:
+        Image.Image | None: The screen, or None if it can't be captured, e.g. on a headless host
+    """
+    try:
+        return ImageGrab.grab()
+    except OSError as e:
+        print(f"No screenshot for the error report: {str(e)}")
+        return None
+
+
+def encode_screenshot(screen: Image.Image, max_width: int = config.ERROR_SCREENSHOT_MAX_WIDTH, max_bytes: int = config.ERROR_SCREENSHOT_MAX_BYTES):
+    """Encode a grabbed screen as JPEG, downscaled to `max_width` and compressed until it fits in `max_bytes`.
+
+    Returns:
+        bytes | None: The JPEG, or None if it doesn't fit
+    """
+    screenshot = screen.convert("RGB")
+    if screenshot.width > max_width:
+        screenshot = screenshot.resize((max_width, round(screenshot.height * max_width / screenshot.width)), Image.Resampling.LANCZOS)
+
+    for quality in (70, 50, 30):
+        buffer = BytesIO()
+        screenshot.save(buffer, format='JPEG', quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes:
+            return buffer.getvalue()
+
+    print(f"Screenshot larger than {max_bytes} bytes, sending the error report without it")
+    return None
@@ -7,8 +7,10 @@ from OpenOrchestrator.database.queues import QueueElement, QueueStatus
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
 from robot_framework import config
-from robot_framework import error_screenshot
 from robot_framework import servicenow_handler
+from robot_framework.subprocesses.error_reporter import error_reporter
+from robot_framework.subprocesses.orchestrator_cache import orchestrator_cache
+from robot_framework.subprocesses.queue_leasing import queue_leaser
 
 
 class BusinessError(Exception):
@@ -19,7 +21,7 @@ def handle_error(message: str, error_count: str | None, error: Exception, queue_
     """Handles an error caught during the process.
     Logs an error to OpenOrchestrator.
     Marks the queue element (if any) as failed.
-    Sends an error screenshot by email.
+    Queues an error screenshot to be sent by email, unless the error is a BusinessError.
 
     Args:
         message: A message to prepend to the error message.
@@ -39,13 +41,12 @@ def handle_error(message: str, error_count: str | None, error: Exception, queue_
         if len(error_msg) > 1000
         else error_msg
     )  # Shorten error msg such that it can be sent to SQL database
-    error_email = orchestrator_connection.get_constant(config.ERROR_EMAIL).value
-
     orchestrator_connection.log_error(error_msg)
     if queue_element:
-        orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.FAILED, error_msg)
-    if error != BusinessError:
-        error_screenshot.send_error_screenshot(error_email, error, orchestrator_connection.process_name)
+        queue_leaser.set_status(orchestrator_connection, queue_element.id, QueueStatus.FAILED, error_msg)
+    if not isinstance(error, BusinessError):
+        error_email = orchestrator_cache.get_constant(orchestrator_connection, config.ERROR_EMAIL).value
+        error_reporter.report(error_email, error, orchestrator_connection.process_name)
 
     if message == "ApplicationException" and error_count == config.MAX_RETRY_COUNT:
         try:
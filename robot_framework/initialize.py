@@ -1,12 +1,18 @@
 """This module defines any initial processes to run when the robot starts."""
 
+import hashlib
 import json
 from datetime import datetime
 
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
-from robot_framework.sql_scripts.kvalitetskontroller import PROCESS_PROCEDURE_DICT
+from robot_framework.sql_scripts.kvalitetskontroller import PROCESS_PROCEDURE_DICT, all_controls
+from robot_framework import config
 from robot_framework.config import QUEUE_NAME
 from robot_framework.subprocesses.helper_functions import format_item
+from robot_framework.subprocesses.digest import build_digests
+from robot_framework.subprocesses.notification_ledger import finding_key, notification_ledger
+from robot_framework.subprocesses.run_config import RunConfig, get_run_config
+from robot_framework.subprocesses.workers import WORKER_MAP
 
 
 def initialize(orchestrator_connection: OrchestratorConnection) -> None:
@@ -22,12 +28,12 @@ def get_items(orchestrator_connection: OrchestratorConnection):
     Function to retrieve items for robot.
     Uses stored procedures in SQL database
     """
-    # Unpack from connection
-    oc_args = json.loads(orchestrator_connection.process_arguments)
-    process = oc_args.get("process", None).upper()
+    # Parse and validate the process arguments before any database work
+    run_config = get_run_config(orchestrator_connection)
+    process = run_config.process
 
-    if not process:
-        raise ValueError(f"No process defined in process arguments: {oc_args}")
+    if run_config.notification_type not in WORKER_MAP:
+        raise ValueError(f"No worker defined for notification type {run_config.notification_type}")
 
     # Set variables for function call
     process_procedure = PROCESS_PROCEDURE_DICT.get(
@@ -46,25 +52,124 @@ def get_items(orchestrator_connection: OrchestratorConnection):
         ValueError(f"No parameters for {process_procedure} in dictionary")
     )
 
+    controls = procedure_params["controls"] if process == "ALL" else (process,)
+    validate_receivers(run_config, controls)
+
     orchestrator_connection.log_trace(f"Running {process = }, procedure {control_procedure.__name__}, {procedure_params = }")
 
     # Get items for process
-    items = control_procedure(**procedure_params, orchestrator_connection=orchestrator_connection)
+    if run_config.incremental and "evaluate" in process_procedure:
+        # Incremental detection works on the shared employment scan
+        items = all_controls((process,), orchestrator_connection)[process]
+    else:
+        items = control_procedure(**procedure_params, orchestrator_connection=orchestrator_connection)
+
+    # In ALL mode the items are returned per process, and each process gets its own queue
+    items_per_process = items if process == "ALL" else {process: items}
+
+    if config.NOTIFICATION_LEDGER_ENABLED and run_config.suppress_repeats:
+        # Leave out findings that were notified recently
+        for item_process, process_items in items_per_process.items():
+            items_per_process[item_process], suppressed = notification_ledger.filter(
+                item_process, process_items, run_config.receiver_field(item_process), run_config.receiver_for(item_process)
+            )
+            orchestrator_connection.log_trace(f"{item_process}: {suppressed} findings notified recently, not notified again")
+
+    if run_config.digest:
+        # One element per receiver. In ALL mode the processes share digests, unless digest_by_kv is set
+        if process == "ALL" and not run_config.digest_by_kv:
+            data_per_queue = {process: build_digests(items_per_process, run_config.receiver_field(process))}
+        else:
+            data_per_queue = {
+                item_process: build_digests({item_process: process_items}, run_config.receiver_field(item_process))
+                for item_process, process_items in items_per_process.items()
+            }
+    else:
+        data_per_queue = {
+            item_process: [json.dumps(format_item(item), ensure_ascii=False) for item in process_items or []]
+            for item_process, process_items in items_per_process.items()
+        }
+
+    # Set dynamic queuenames in connection
+    orchestrator_connection.queue_names = [f"{QUEUE_NAME}.{queue_process}" for queue_process in data_per_queue]
+    orchestrator_connection.queue_name = orchestrator_connection.queue_names[0]
+
+    for queue_process, data in data_per_queue.items():
+        populate_queue(orchestrator_connection, queue_process, data)
+
+
+def validate_receivers(run_config: RunConfig, controls: tuple):
+    """
+    Check that each control has a receiver it can notify. Only controls that combine their findings with
+    AF emails (see "af_receiver" in PROCESS_PROCEDURE_DICT) can notify the AF.
+    ServiceNow cases need digests, so the cases of many findings are created in one call. Raises ValueError otherwise
+    """
+    if run_config.notification_type == "ServiceNow case" and not run_config.digest:
+        raise ValueError('Notification type "ServiceNow case" needs "digest": true in process arguments')
+
+    for control in controls:
+        if run_config.af_receiver(control) and not PROCESS_PROCEDURE_DICT[control].get("af_receiver", False):
+            raise ValueError(f"{control} findings can't be sent to the AF. Give {control} its own notification_receiver")
 
-    # Set dynamic queuename in connection
-    orchestrator_connection.queue_name = f"{QUEUE_NAME}.{process}"
+    if run_config.process == "ALL" and run_config.digest and not run_config.digest_by_kv:
+        if not isinstance(run_config.notification_receiver, str):
+            raise ValueError("Shared digests (digest_by_kv false) need one notification_receiver for all controls")
 
-    if items:
+
+def populate_queue(orchestrator_connection: OrchestratorConnection, process: str, data: list[str]):
+    """
+    Create queue elements with the given data in the queue of the process.
+
+    References are derived from the identity of the finding (or the content of a digest) and the date,
+    so elements already created today, e.g. by an earlier initialization, are skipped.
+    """
+    queue_name = f"{QUEUE_NAME}.{process}"
+    elements = {queue_reference(process, element_data): element_data for element_data in data}
+    existing = existing_references(orchestrator_connection, queue_name) if elements else set()
+    new_elements = {reference: element_data for reference, element_data in elements.items() if reference not in existing}
+    # Findings with the same identity in this run share a reference, so only one element is created for them
+    queued = len(elements) - len(new_elements)
+    collapsed = len(data) - len(elements)
+
+    if new_elements:
         # Populate queue
         orchestrator_connection.bulk_create_queue_elements(
-            queue_name=orchestrator_connection.queue_name,
-            references=[
-                f"{process}_{datetime.now().strftime('%d%m%y')}_{i+1}" for i in range(len(items))
-            ],
-            data = [json.dumps(format_item(item), ensure_ascii=False) for item in items],
+            queue_name=queue_name,
+            references=list(new_elements),
+            data=list(new_elements.values()),
             created_by="SD-lon_robot"
         )
-        orchestrator_connection.log_trace(f"Populated queue with {len(items)} items.")
+        orchestrator_connection.log_trace(
+            f"Populated queue for {process} with {len(new_elements)} items. {queued} already in queue, {collapsed} duplicates in this run."
+        )
+
+    elif data:
+        orchestrator_connection.log_trace(
+            f"All {queued} items for {process} already in queue, {collapsed} duplicates in this run. Queue not populated"
+        )
 
     else:
-        orchestrator_connection.log_trace("No items found. Queue not populated")
+        orchestrator_connection.log_trace(f"No items found for {process}. Queue not populated")
+
+
+def queue_reference(process: str, element_data: str):
+    """Reference of a queue element: process, date and a hash of the finding's identity, e.g. KV2_170526_3f2a9c0d1e4b5a6c"""
+    decoded = json.loads(element_data)
+    identity = element_data if "rows" in decoded else json.dumps(finding_key(process, decoded), ensure_ascii=False)
+    digest = hashlib.sha256(identity.encode()).hexdigest()[:16]
+    return f"{process}_{datetime.now().strftime('%d%m%y')}_{digest}"
+
+
+def existing_references(orchestrator_connection: OrchestratorConnection, queue_name: str):
+    """References of the elements created in the queue today. References contain the date, so only these can collide"""
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    references = set()
+    offset = 0
+    while True:
+        elements = orchestrator_connection.get_queue_elements(
+            queue_name, from_date=today, offset=offset, limit=config.QUEUE_REFERENCE_PAGE_SIZE
+        )
+        references.update(element.reference for element in elements)
+        if len(elements) < config.QUEUE_REFERENCE_PAGE_SIZE:
+            return references
+        offset += len(elements)
@@ -1,9 +1,11 @@
 """This module contains the main process of the robot."""
-import json
-
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 from OpenOrchestrator.database.queues import QueueElement
 
+from robot_framework import config
+from robot_framework.subprocesses.digest import digest_findings
+from robot_framework.subprocesses.notification_ledger import notification_ledger
+from robot_framework.subprocesses.run_config import QueuePayload, get_run_config
 from robot_framework.subprocesses.workers import WORKER_MAP
 
 
@@ -12,14 +14,15 @@ def process(orchestrator_connection: OrchestratorConnection, queue_element: Queu
     """Do the primary process of the robot."""
     orchestrator_connection.log_trace("Running process.")
 
-    # Load arguments and creds
-    oc_args = json.loads(orchestrator_connection.process_arguments)
-    process_type = oc_args['process'].upper()
-    notification_type = oc_args['notification_type']
-    notification_receiver = oc_args['notification_receiver']
-
-    if notification_receiver == "AF":
-        notification_receiver = json.loads(queue_element.data)["AF_email"]
+    # Load arguments and the element data. The data is decoded once and passed on to the worker
+    run_config = get_run_config(orchestrator_connection)
+    process_type = run_config.process
+    if process_type == "ALL":
+        # Elements are queued per process, e.g. in "per.sdloen.KV1"
+        process_type = queue_element.queue_name.rsplit(".", 1)[-1]
+    notification_type = run_config.notification_type
+    payload = QueuePayload.from_element(queue_element)
+    notification_receiver = payload.receiver(run_config, process_type)
 
     # Find and apply worker
     worker = WORKER_MAP.get(notification_type, None)
@@ -32,7 +35,12 @@ def process(orchestrator_connection: OrchestratorConnection, queue_element: Queu
         orchestrator_connection=orchestrator_connection,
         process_type=process_type,
         notification_receiver=notification_receiver,
-        queue_element=queue_element
+        payload=payload
     )
 
+    if config.NOTIFICATION_LEDGER_ENABLED and run_config.suppress_repeats:
+        # Only findings whose notification was sent are recorded as notified
+        findings = digest_findings(payload.data) if payload.is_digest else {process_type: [payload.data]}
+        notification_ledger.confirm(findings, notification_receiver)
+
     orchestrator_connection.log_trace("Process finished")
@@ -4,9 +4,10 @@
 # pylint: disable=duplicate-code
 
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
-from OpenOrchestrator.database.queues import QueueStatus
+from OpenOrchestrator.database.queues import QueueElement, QueueStatus
 
 from robot_framework import initialize
 from robot_framework import reset
@@ -14,6 +15,8 @@ from robot_framework.exceptions import handle_error, BusinessError, log_exceptio
 from robot_framework import process
 from robot_framework import config
 from robot_framework import finalize
+from robot_framework.subprocesses.error_reporter import error_reporter
+from robot_framework.subprocesses.queue_leasing import queue_leaser
 
 
 def main():
@@ -23,30 +26,52 @@ def main():
 
     orchestrator_connection.log_trace("Robot Framework started.")
     initialize.initialize(orchestrator_connection)
+    queue_leaser.recover()
 
     queue_element = None
     error_count = 0
     task_count = 0
-    # Retry loop
-    for _ in range(config.MAX_RETRY_COUNT):
+    # Retry loop. Every failed element counts as an error, also when several fail at the same time
+    while error_count < config.MAX_RETRY_COUNT:
         try:
             reset.reset(orchestrator_connection)
 
-            # Queue loop
-            while task_count < config.MAX_TASK_COUNT:
-                task_count += 1
-                queue_element = orchestrator_connection.get_next_queue_element(orchestrator_connection.queue_name)
-
-                if not queue_element:
-                    orchestrator_connection.log_info("Queue empty.")
-                    break  # Break queue loop
-
-                try:
-                    process.process(orchestrator_connection, queue_element)
-                    orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.DONE)
-
-                except BusinessError as error:
-                    handle_error("BusinessException", None, error, queue_element, orchestrator_connection)
+            # Queue loop. Elements are processed by a pool of workers, with at most QUEUE_WORKER_COUNT in flight
+            in_flight = {}
+            failed = None
+            queue_empty = False
+            with ThreadPoolExecutor(max_workers=config.QUEUE_WORKER_COUNT) as executor:
+                while True:
+                    while not queue_empty and not failed and len(in_flight) < config.QUEUE_WORKER_COUNT and task_count < config.MAX_TASK_COUNT:
+                        task_count += 1
+                        next_element = get_next_queue_element(orchestrator_connection, config.MAX_TASK_COUNT - task_count + 1)
+
+                        if not next_element:
+                            orchestrator_connection.log_info("Queue empty.")
+                            queue_empty = True
+                            break
+
+                        in_flight[executor.submit(process_element, orchestrator_connection, next_element)] = next_element
+
+                    if not in_flight:
+                        break  # Break queue loop
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        element = in_flight.pop(future)
+                        error = future.exception()
+                        if error is None:
+                            continue
+                        if failed:
+                            # Only the first failure is raised to the retry loop. Later ones are handled the same way here
+                            error_count = handle_later_failure(orchestrator_connection, element, error, error_count)
+                        else:
+                            # Stop taking new elements and let the ones in flight finish
+                            failed = (element, error)
+
+            if failed:
+                queue_element, error = failed
+                raise error
 
             break  # Break retry loop
 
@@ -56,11 +81,45 @@ def main():
             error_count += 1
             handle_error("ApplicationException", error_count, error, queue_element, orchestrator_connection)
 
+    queue_leaser.release()
+    # Error reports are sent in the background. Send the waiting ones before the robot stops
+    error_reporter.flush()
     reset.clean_up(orchestrator_connection)
     reset.close_all(orchestrator_connection)
     reset.kill_all(orchestrator_connection)
 
-    if config.FAIL_ROBOT_ON_TOO_MANY_ERRORS and error_count == config.MAX_RETRY_COUNT:
+    if config.FAIL_ROBOT_ON_TOO_MANY_ERRORS and error_count >= config.MAX_RETRY_COUNT:
         raise RuntimeError("Process failed too many times.")
 
     finalize.finalize(orchestrator_connection)
+
+
+def process_element(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement):
+    """Process a queue element and set its status. Business errors are handled here, other errors are raised"""
+    try:
+        process.process(orchestrator_connection, queue_element)
+        queue_leaser.set_status(orchestrator_connection, queue_element.id, QueueStatus.DONE)
+
+    except BusinessError as error:
+        handle_error("BusinessException", None, error, queue_element, orchestrator_connection)
+
+
+def handle_later_failure(orchestrator_connection: OrchestratorConnection, queue_element: QueueElement, error: Exception, error_count: int):
+    """Handle an element that failed while another failure was waiting for the retry loop. Returns the new error count"""
+    try:
+        raise error
+    # Raised again so handle_error has its traceback
+    # pylint: disable-next = broad-exception-caught
+    except Exception as e:
+        handle_error("ApplicationException", error_count + 1, e, queue_element, orchestrator_connection)
+    return error_count + 1
+
+
+def get_next_queue_element(orchestrator_connection: OrchestratorConnection, limit: int):
+    """Get the next element from the queues of the run. In ALL mode the queues are emptied one at a time.
+    Elements are leased in batches of at most `limit`"""
+    for queue_name in orchestrator_connection.queue_names:
+        queue_element = queue_leaser.next_element(orchestrator_connection, queue_name, limit)
+        if queue_element:
+            return queue_element
+    return None
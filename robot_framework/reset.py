@@ -2,6 +2,19 @@
 
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
+from robot_framework.servicenow_handler import service_now_client
+from robot_framework.subprocesses.connection_manager import connection_manager
+from robot_framework.subprocesses.error_reporter import error_reporter
+from robot_framework.subprocesses.incident_cache import incident_cache
+from robot_framework.subprocesses.incremental import incremental_store
+from robot_framework.subprocesses.mail_sender import mail_sender
+from robot_framework.subprocesses.notification_ledger import notification_ledger
+from robot_framework.subprocesses.orchestrator_cache import orchestrator_cache
+from robot_framework.subprocesses.queue_leasing import queue_leaser
+from robot_framework.subprocesses.reference_cache import reference_cache
+from robot_framework.subprocesses.servicenow_cases import case_submitter
+from robot_framework.subprocesses.snapshot_store import snapshot_store
+
 
 def reset(orchestrator_connection: OrchestratorConnection) -> None:
     """Clean up, close/kill all programs and start them again. """
@@ -20,6 +33,23 @@ def clean_up(orchestrator_connection: OrchestratorConnection) -> None:
 def close_all(orchestrator_connection: OrchestratorConnection) -> None:
     """Gracefully close all applications used by the robot."""
     orchestrator_connection.log_trace("Closing all applications.")
+    orchestrator_connection.log_trace(connection_manager.format_stats())
+    orchestrator_connection.log_trace(reference_cache.format_stats())
+    orchestrator_connection.log_trace(snapshot_store.format_stats())
+    orchestrator_connection.log_trace(mail_sender.format_stats())
+    orchestrator_connection.log_trace(queue_leaser.format_stats())
+    orchestrator_connection.log_trace(notification_ledger.format_stats())
+    orchestrator_connection.log_trace(incremental_store.format_stats())
+    orchestrator_connection.log_trace(orchestrator_cache.format_stats())
+    orchestrator_connection.log_trace(service_now_client.format_stats())
+    orchestrator_connection.log_trace(incident_cache.format_stats())
+    orchestrator_connection.log_trace(case_submitter.format_stats())
+    orchestrator_connection.log_trace(error_reporter.format_stats())
+    connection_manager.close_all()
+    mail_sender.close()
+    service_now_client.close()
+    # Constants and credentials are read again after a reset, in case they were changed in Orchestrator
+    orchestrator_cache.invalidate()
 
 
 def kill_all(orchestrator_connection: OrchestratorConnection) -> None:
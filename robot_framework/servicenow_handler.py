@@ -1,13 +1,117 @@
 """ServiceNow Incident handler - this script creates a new incident in ServiceNow or adds a comment to an existing one"""
 
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from robot_framework import config
+from robot_framework.subprocesses.incident_cache import incident_cache
+from robot_framework.subprocesses.orchestrator_cache import orchestrator_cache
 
 
 PROD_INSTANCE = "aarhuskommune"
 TEST_INSTANCE = "aarhuskommunedev"
 
+INCIDENT_PATH = "/api/now/table/incident"
+
+
+class ServiceNowClient:
+    """
+    Sends requests to the ServiceNow table API over one pooled keep-alive session.
+
+    Every request has connect and read timeouts. Failed connects are retried with exponential backoff,
+    at most `retries` times, and so are 429/502/503/504 answers to GET and PUT requests. A Retry-After
+    header is not waited for, and read timeouts are not retried, so a slow instance can't stall the robot for long.
+    POST requests are only retried when the connection failed, since a 502-504 answer or a read timeout
+    doesn't tell whether the record was created, and retrying could create it twice.
+    """
+
+    def __init__(self, timeout: tuple[float, float] = config.SERVICE_NOW_TIMEOUT, retries: int = config.SERVICE_NOW_RETRIES,
+                 backoff_factor: float = config.SERVICE_NOW_BACKOFF_FACTOR):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._session = None
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    @property
+    def base_url(self):
+        """URL of the configured instance, or of SERVICE_NOW_BASE_URL if it is set"""
+        if config.SERVICE_NOW_BASE_URL:
+            return config.SERVICE_NOW_BASE_URL.rstrip("/")
+        instance = PROD_INSTANCE if config.SERVICE_NOW_USE_PROD else TEST_INSTANCE
+        return f"https://{instance}.service-now.com"
+
+    def request(self, orchestrator_connection, method: str, path: str, **kwargs):
+        """
+        Send a request to the ServiceNow API, authenticated with the ServiceNow credential.
+
+        Args:
+            method: HTTP method, e.g. "GET"
+            path: Path of the API, e.g. "/api/now/table/incident/<sys_id>"
+
+        Returns:
+            requests.Response: The response. Raises requests.RequestException if no response was received
+        """
+        credential = orchestrator_cache.get_credential(orchestrator_connection, config.SERVICE_NOW_API_PROD_USER)
+        try:
+            response = self._get_session().request(
+                method, self.base_url + path, auth=(credential.username, credential.password), timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException:
+            self._count("errors")
+            raise
+
+        self._count("requests")
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None:
+            self._count("retries", len(retries.history))
+        if response.status_code == 401:
+            # Drop the cached credential, so the next request reads it from Orchestrator again
+            orchestrator_cache.invalidate(config.SERVICE_NOW_API_PROD_USER)
+        return response
+
+    def close(self):
+        """Close the session and its pooled connections"""
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return f"ServiceNow: {stats['requests']} requests, {stats['retries']} retries, {stats['errors']} failed"
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                retry = Retry(
+                    total=self.retries,
+                    connect=self.retries,
+                    read=0,
+                    status=self.retries,
+                    status_forcelist=(429, 502, 503, 504),
+                    allowed_methods=("GET", "PUT"),
+                    backoff_factor=self.backoff_factor,
+                    respect_retry_after_header=False,
+                    raise_on_status=False,
+                )
+                session = requests.Session()
+                adapter = HTTPAdapter(max_retries=retry, pool_maxsize=config.SERVICE_NOW_MAX_CONCURRENT_REQUESTS)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+                self._session = session
+            return self._session
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
 
 def handle_incident(orchestrator_connection, error_dict):
     """
@@ -31,23 +135,20 @@ def get_incident(orchestrator_connection):
 
     process_name = orchestrator_connection.process_name
 
+    # The incident found last time is fetched by its sys_id. The search below is only needed if it has been resolved
+    cached_sys_id = incident_cache.get(process_name)
+    if cached_sys_id:
+        if incident_is_open(orchestrator_connection, cached_sys_id):
+            return cached_sys_id
+        incident_cache.forget(process_name)
+
     # Here we specify the incidents we would like returned - short description must include the process name, state can not be 6 as that means the incident is resolved
     # We order by latest created incident, so we always update the newest returned - in theory the request should only return 1 incident
     query = f"short_descriptionLIKE{process_name}^active=true^state!=6^ORDERBYDESCsys_created_on"
 
-    # get_url = f"https://{PROD_INSTANCE}.service-now.com/api/now/table/incident?sysparm_limit=50&sysparm_query={query}"
-    get_url = f"https://{TEST_INSTANCE}.service-now.com/api/now/table/incident?sysparm_limit=50&sysparm_query={query}"
-
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-
-    service_now_api_username = orchestrator_connection.get_credential(config.SERVICE_NOW_API_PROD_USER).username
-    service_now_api_password = orchestrator_connection.get_credential(config.SERVICE_NOW_API_PROD_USER).password
-
-    # pylint: disable=missing-timeout
-    response = requests.get(get_url, headers=headers, auth=(service_now_api_username, service_now_api_password))
+    response = service_now_client.request(
+        orchestrator_connection, "GET", INCIDENT_PATH, params={"sysparm_limit": 50, "sysparm_query": query}
+    )
 
     # pylint: disable=no-else-return
     if response.status_code == 200:
@@ -55,6 +156,7 @@ def get_incident(orchestrator_connection):
 
         if results:
             print(results[0].get("sys_id"))
+            incident_cache.put(process_name, results[0].get("sys_id"))
 
             return results[0].get("sys_id")  # Only return first match
 
@@ -67,6 +169,22 @@ def get_incident(orchestrator_connection):
         return None
 
 
+def incident_is_open(orchestrator_connection, sys_id):
+    """
+    Checks whether the incident with the given sys_id exists and is not resolved
+    """
+
+    response = service_now_client.request(
+        orchestrator_connection, "GET", f"{INCIDENT_PATH}/{sys_id}", params={"sysparm_fields": "active,state"}
+    )
+
+    if response.status_code != 200:
+        return False
+
+    result = response.json().get("result", {})
+    return str(result.get("active")).lower() == "true" and str(result.get("state")) != "6"
+
+
 def update_incident(orchestrator_connection, error_dict, existing_incident_sys_id):
     """
     Method to update an existing incident - the method adds a new comment to the existing incident
@@ -85,23 +203,11 @@ def update_incident(orchestrator_connection, error_dict, existing_incident_sys_i
     print()
     print(comment_text)
 
-    # put_url = f"https://{PROD_INSTANCE}.service-now.com/api/now/table/incident/{existing_incident_sys_id}"
-    put_url = f"https://{TEST_INSTANCE}.service-now.com/api/now/table/incident/{existing_incident_sys_id}"
-
     incident_data = {
         "comments": f'{comment_text}'
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-
-    service_now_api_username = orchestrator_connection.get_credential(config.SERVICE_NOW_API_PROD_USER).username
-    service_now_api_password = orchestrator_connection.get_credential(config.SERVICE_NOW_API_PROD_USER).password
-
-    # pylint: disable=missing-timeout
-    response = requests.put(put_url, headers=headers, auth=(service_now_api_username, service_now_api_password), json=incident_data)
+    response = service_now_client.request(orchestrator_connection, "PUT", f"{INCIDENT_PATH}/{existing_incident_sys_id}", json=incident_data)
 
     # pylint: disable=no-else-return
     if response.status_code == 200:
@@ -123,9 +229,6 @@ def post_incident(orchestrator_connection, error_dict):
     error_message = error_dict.get("message", "")  # The actual Exception message in str format
     error_trace = error_dict.get("trace", "")  # The traceback.format_exc() in str format
 
-    # post_url = f"https://{PROD_INSTANCE}.service-now.com/api/now/table/incident"
-    post_url = f"https://{TEST_INSTANCE}.service-now.com/api/now/table/incident"
-
     incident_data = {
         "contact_type": "integration",  # Should always be 'integration' - this just means the incident was created using the ServiceNow API
         "short_description": f"ApplicationException caught in process '{orchestrator_connection.process_name}'",
@@ -138,26 +241,24 @@ def post_incident(orchestrator_connection, error_dict):
         "category": "Fejl",
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
-
-    service_now_api_username = orchestrator_connection.get_credential(config.SERVICE_NOW_API_PROD_USER).username
-    service_now_api_password = orchestrator_connection.get_credential(config.SERVICE_NOW_API_PROD_USER).password
-
-    # pylint: disable=missing-timeout
-    response = requests.post(post_url, headers=headers, auth=(service_now_api_username, service_now_api_password), json=incident_data)
+    response = service_now_client.request(orchestrator_connection, "POST", INCIDENT_PATH, json=incident_data)
 
     print()
     print("Response Status Code:", response.status_code)
     print("Response Text:", response.text)
 
     # pylint: disable=no-else-return
-    if response.status_code == 200:
-        return response.json().get("result", {})
+    if response.status_code in (200, 201):
+        result = response.json().get("result", {})
+        if result.get("sys_id"):
+            incident_cache.put(orchestrator_connection.process_name, result["sys_id"])
+        return result
 
     else:
         print(f"Error {response.status_code}: {response.text}")
 
         return None
+
+
+# Shared by all ServiceNow requests in the robot run
+service_now_client = ServiceNowClient()
@@ -1,12 +1,24 @@
 """Functions that defines errors to be handled by the robot"""
 
-import json
+from functools import partial
 
 import pandas as pd
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
-from robot_framework.subprocesses.helper_functions import get_items_from_query
-from robot_framework.worker_data.kv2_data import tillaeg_pairs
+from robot_framework.subprocesses.helper_functions import (
+    enrich,
+    fetch_concurrently,
+    get_columns_from_query,
+    get_items_from_query,
+    get_frame_from_query,
+    in_clause,
+    key_set_sql,
+)
+from robot_framework.subprocesses.incremental import incremental_store
+from robot_framework.subprocesses.orchestrator_cache import orchestrator_cache
+from robot_framework.subprocesses.reference_cache import cached_reference_data
+from robot_framework.subprocesses.run_config import get_run_config
+from robot_framework.worker_data.kv2_data import tillaeg_index
 
 
 def kv1(overenskomst: int, orchestrator_connection: OrchestratorConnection):
@@ -21,7 +33,7 @@ def kv1(overenskomst: int, orchestrator_connection: OrchestratorConnection):
         items (list | None): List of items from the SELECT query. If no elements fits the query then returns None
     """
 
-    sql = f"""
+    sql = """
         SELECT
             ans.Tjenestenummer, ans.Overenskomst, ans.Afdeling, ans.Institutionskode, perstam.Navn, ans.Startdato, ans.Slutdato, ans.Statuskode, org.LOSID
         FROM [Personale].[sd_magistrat].[Ansættelse_mbu] ans
@@ -31,124 +43,117 @@ def kv1(overenskomst: int, orchestrator_connection: OrchestratorConnection):
                 on ans.Afdeling = org.SDafdID
         WHERE
             Slutdato > getdate() and Startdato <= getdate()
-            and ans.Overenskomst={overenskomst}
+            and ans.Overenskomst = ?
             and ans.Statuskode in ('1', '3', '5')
             and ans.Institutionskode!='XC'
     """
 
-    oc_args = json.loads(orchestrator_connection.process_arguments)
-    receiver = oc_args.get("notification_receiver", None).upper()
-    af_receiver = receiver == "AF"
-
-    connection_string = orchestrator_connection.get_constant(
-        "FaellesDbConnectionString"
+    connection_string = orchestrator_cache.get_constant(
+        orchestrator_connection, "FaellesDbConnectionString"
     ).value
-    items = get_items_from_query(connection_string, sql)
-    if items and af_receiver:
-        item_df = pd.DataFrame(items).astype({"LOSID": int}, errors="ignore")
-
-        items = combine_with_af_email(
-            orchestrator_connection=orchestrator_connection, item_df=item_df
-        )
+    items = get_items_from_query(connection_string, sql, [overenskomst])
+    items = combine_for_receiver(items, orchestrator_connection, "KV1")
 
     return items
 
 
-def kv2(tillaegsnr_par: list, orchestrator_connection: OrchestratorConnection):
+def kv2(tillaeg_pair_index: dict, orchestrator_connection: OrchestratorConnection):
     """
     CASE: HAS ONLY ONE OF A PAIR OF 'TILLÆGSNUMRE'
 
+    All pairs are sent to the server as one VALUES table, so the check is a single query
+    regardless of how many pairs are defined.
+
     Arguments:
-        tillaegsnr_par (list): List of dicts with keys:
-            - 'ovk' (str)
-            - 'pair' (tuple of two elements)
-            - 'pair_names' (tuple of two elements)
+        tillaeg_pair_index (dict): The pairs indexed by tillægsnummer, see kv2_data.build_pair_index
         connection_string (string): Connection string for pyodbc connection
 
     Returns:
         items (list | None): List of items from the SELECT query. If no elements fits the query then returns None
     """
 
-    items = None
-
-    connection_string = orchestrator_connection.get_constant(
-        "FaellesDbConnectionString"
+    connection_string = orchestrator_cache.get_constant(
+        orchestrator_connection, "FaellesDbConnectionString"
     ).value
 
-    for pair in tillaegsnr_par:
-        sql = f"""
+    pair_values, pair_params = kv2_pair_values(tillaeg_pair_index)
+    sql = f"""
+        WITH par AS (
+            SELECT
+                par_id, ovk, tillaegsnummer
+            FROM (VALUES
+                {pair_values}
+            ) AS v(par_id, ovk, tillaegsnummer)
+        ),
+        fundne AS (
+            SELECT
+                ans.AnsættelsesID, ans.Tjenestenummer, ans.Overenskomst, ans.Afdeling, ans.Institutionskode, ans.CPR,
+                til.Tillægsnummer, til.Tillægsnavn, par.par_id
+            FROM
+                [Personale].[sd_magistrat].Ansættelse_mbu ans
+                join [Personale].[sd_magistrat].[tillæg_mbu] til
+                    on ans.AnsættelsesID = til.AnsættelsesID
+                join par
+                    on til.Tillægsnummer = par.tillaegsnummer and ans.Overenskomst = par.ovk
+            WHERE
+                ans.Slutdato > GETDATE() and ans.Startdato < GETDATE()
+                and ans.Statuskode in ('1', '3', '5')
+        ),
+        uparrede AS (
+            SELECT
+                AnsættelsesID, par_id
+            FROM
+                fundne
+            GROUP BY
+                AnsættelsesID, par_id
+            HAVING
+                count(distinct Tillægsnummer) != 2
+        )
         SELECT
-            ans.Tjenestenummer, til.Tillægsnummer, til.Tillægsnavn, ans.Overenskomst, ans.Afdeling, perstam.Navn, ans.Institutionskode
+            f.Tjenestenummer, f.Tillægsnummer, f.Tillægsnavn, f.Overenskomst, f.Afdeling, perstam.Navn, f.Institutionskode
         FROM
-            [Personale].[sd_magistrat].Ansættelse_mbu ans
-            right join [Personale].[sd_magistrat].[tillæg_mbu] til
-                on ans.AnsættelsesID = til.AnsættelsesID
-            right join [Personale].[sd].[personStam] perstam
-                on ans.CPR = perstam.CPR
-        WHERE
-            til.Tillægsnummer in {pair["pair"]}
-            and ans.Overenskomst = {pair["ovk"]}
-            and ans.Slutdato > GETDATE() and ans.Startdato < GETDATE()
-            and ans.Statuskode in ('1', '3', '5')
-            and ans.AnsættelsesID in (
-                SELECT
-                    ans.AnsættelsesID
-                FROM
-                    [Personale].[sd_magistrat].Ansættelse_mbu ans
-                    right join [Personale].[sd_magistrat].[tillæg_mbu] til
-                        on ans.AnsættelsesID = til.AnsættelsesID
-                WHERE
-                    (til.Tillægsnummer in {pair["pair"]} and ans.Overenskomst = {pair["ovk"]})
-                    and ans.Slutdato > GETDATE()
-                    and ans.Startdato < GETDATE()
-                    and ans.Statuskode in ('1', '3', '5')
-                GROUP BY
-                    ans.AnsættelsesID
-                HAVING
-                    count(distinct til.Tillægsnummer) != 2
-            )
-        """
-
-        pair_items = get_items_from_query(connection_string, sql)
-        if not items:
-            items = pair_items
-        else:
-            items.extend(pair_items if pair_items else [])
-
-    # Combine SD departments with LIS unit names (enhedsnavne)
-    items_df = pd.DataFrame(items)
+            fundne f
+            join uparrede u
+                on f.AnsættelsesID = u.AnsættelsesID and f.par_id = u.par_id
+            join [Personale].[sd].[personStam] perstam
+                on f.CPR = perstam.CPR
+    """
 
-    connection_string_mbu = orchestrator_connection.get_constant(
-        "DbConnectionString"
+    connection_string_mbu = orchestrator_cache.get_constant(
+        orchestrator_connection, "DbConnectionString"
     ).value
-    lis_dep = lis_enheder(connection_string=connection_string_mbu)
-    lis_df = pd.DataFrame(lis_dep).rename(columns={"losid": "LOSID"})
-    lis_df = lis_df[~lis_df["LOSID"].isna()].copy(deep=True)
-    lis_df["LOSID"] = lis_df["LOSID"].astype(int, errors="ignore")
-
-    sd_dep = sd_enheder(connection_string=connection_string)
-    sd_df = pd.DataFrame(sd_dep)
-    sd_df = sd_df[~sd_df["LOSID"].isna()].copy(deep=True)
-    sd_df["LOSID"] = sd_df["LOSID"].astype(int, errors="ignore")
 
-    dep_df = pd.merge(
-        left=lis_df[~lis_df["LOSID"].isna()], right=sd_df, how="inner", on="LOSID"
-    ).rename(columns={"SDafdID": "Afdeling", "enhnavn": "Enhedsnavn"})
-
-    items_dep = pd.merge(left=items_df, right=dep_df, how="left", on="Afdeling")[
-        [
-            "Tjenestenummer",
-            "Tillægsnummer",
-            "Tillægsnavn",
-            "Overenskomst",
-            "Afdeling",
-            "Enhedsnavn",
-            "Navn",
-            "Institutionskode",
-        ]
+    # The findings and the department lookups are independent, so they are fetched at the same time
+    results = fetch_concurrently(
+        items=partial(get_items_from_query, connection_string, sql, pair_params),
+        lis=partial(lis_enheder, connection_string=connection_string_mbu),
+        sd=partial(sd_enheder, connection_string=connection_string),
+    )
+    items = results["items"]
+    if not items:
+        return None
+
+    # Combine SD departments with LIS unit names (enhedsnavne).
+    # Only SD departments with a LIS unit are used, as in an inner join of the two
+    lis_df = results["lis"].rename(columns={"losid": "LOSID", "enhnavn": "Enhedsnavn"})
+    sd_df = results["sd"]
+    sd_df = sd_df[
+        pd.to_numeric(sd_df["LOSID"], errors="coerce").isin(pd.to_numeric(lis_df["LOSID"], errors="coerce").dropna())
     ]
 
-    items = list(items_dep.T.to_dict().values())
+    items = enrich(items, sd_df, left_on="Afdeling", right_on="SDafdID", how="left", numeric=False)
+    items = enrich(items, lis_df[["LOSID", "Enhedsnavn"]], left_on="LOSID", how="left")
+    columns = [
+        "Tjenestenummer",
+        "Tillægsnummer",
+        "Tillægsnavn",
+        "Overenskomst",
+        "Afdeling",
+        "Enhedsnavn",
+        "Navn",
+        "Institutionskode",
+    ]
+    items = [{column: item[column] for column in columns} for item in items]
 
     return items
 
@@ -159,28 +164,56 @@ def kv3(
     orchestrator_connection: OrchestratorConnection,
 ):
     """Ansættelser with wrong overenskomst based on departmentype"""
-    connection_string_mbu = orchestrator_connection.get_constant(
-        "DbConnectionString"
-    ).value
-    connection_string_faelles = orchestrator_connection.get_constant(
-        "FaellesDbConnectionString"
+    connection_string_faelles = orchestrator_cache.get_constant(
+        orchestrator_connection, "FaellesDbConnectionString"
     ).value
 
-    # Load department types from LIS stamdata
-    lis_stamdata = lis_enheder(
-        connection_string=connection_string_mbu, afdtype=(2, 3, 4, 5, 11, 13)
+    combined_df, dagtilbud_afd, skole_afd = kv3_departments(orchestrator_connection)
+
+    # Collect ansættelser with wrong overenskomst
+    items_df = kv3_1(
+        connection_str=connection_string_faelles,
+        skole_afd=skole_afd,
+        dagtilbud_afd=dagtilbud_afd,
+        accept_ovk_skole=accept_ovk_skole,
+        accept_ovk_dag=accept_ovk_dag,
     )
-    losid_tuple = tuple(i["losid"] for i in lis_stamdata)
 
-    # Load corresponding SD department codes
-    sd_departments = sd_enheder(
-        losid_tuple=losid_tuple, connection_string=connection_string_faelles
+    return kv3_combine(combined_df, items_df)
+
+
+def kv3_departments(orchestrator_connection: OrchestratorConnection):
+    """
+    Combine LIS department types with SD department codes.
+
+    Returns:
+        tuple: (combined_df, dagtilbud_afd, skole_afd) with the combined departments and the SDafdID's of dagtilbud and skoler
+    """
+    connection_string_mbu = orchestrator_cache.get_constant(
+        orchestrator_connection, "DbConnectionString"
+    ).value
+    connection_string_faelles = orchestrator_cache.get_constant(
+        orchestrator_connection, "FaellesDbConnectionString"
+    ).value
+
+    # Load department types from LIS stamdata and all SD department codes at the same time.
+    # The SD departments are narrowed to the LIS departments afterwards, instead of waiting for the LOSID's
+    results = fetch_concurrently(
+        lis=partial(lis_enheder, connection_string=connection_string_mbu, afdtype=(2, 3, 4, 5, 11, 13)),
+        sd=partial(sd_enheder, connection_string=connection_string_faelles),
     )
+    lis_stamdata = results["lis"]
+    losid_values = pd.to_numeric(lis_stamdata["losid"], errors="coerce")
+
+    # Corresponding SD department codes
+    sd_departments_df = results["sd"]
+    sd_departments_df = sd_departments_df[
+        pd.to_numeric(sd_departments_df["LOSID"], errors="coerce").isin(losid_values)
+    ].copy()
 
     # Combine SD and LIS data
-    lis_stamdata_df = pd.DataFrame(lis_stamdata).rename(columns={"losid": "LOSID"})
+    lis_stamdata_df = lis_stamdata.rename(columns={"losid": "LOSID"})
     lis_stamdata_df["LOSID"] = lis_stamdata_df["LOSID"].astype(int)
-    sd_departments_df = pd.DataFrame(sd_departments)
     sd_departments_df["LOSID"] = sd_departments_df["LOSID"].astype(int)
 
     combined_df = pd.merge(
@@ -194,43 +227,31 @@ def kv3(
             & ~(combined_df["SDafdID"].isna())
         )
     ]
-    dagtilbud_afd = tuple(dagtilbud_df["SDafdID"].values)
+    dagtilbud_afd = tuple(dagtilbud_df["SDafdID"].tolist())
 
     skole_df = combined_df[
         ((combined_df["afdtype"].isin([13])) & ~(combined_df["SDafdID"].isna()))
     ]
-    skole_afd = tuple(skole_df["SDafdID"].values)
+    skole_afd = tuple(skole_df["SDafdID"].tolist())
 
-    # Collect ansættelser with wrong overenskomst
-    items = kv3_1(
-        connection_str=connection_string_faelles,
-        skole_afd=skole_afd,
-        dagtilbud_afd=dagtilbud_afd,
-        accept_ovk_skole=accept_ovk_skole,
-        accept_ovk_dag=accept_ovk_dag,
-    )
-    items_df = pd.DataFrame(items)
+    return combined_df, dagtilbud_afd, skole_afd
 
-    # Combine with other information
-    combined_df = pd.merge(
-        left=combined_df, right=items_df, left_on="SDafdID", right_on="Afdeling"
-    )
-    combined_df["Startdato"] = combined_df["Startdato"].astype(str)
-    combined_df["Slutdato"] = combined_df["Slutdato"].astype(str)
-    combined_df = combined_df.rename(columns={"enhnavn": "Enhedsnavn"})[
-        [
-            "Tjenestenummer",
-            "Afdeling",
-            "Institutionskode",
-            "Overenskomst",
-            "Enhedsnavn",
-            "Navn",
-            "afdtype_txt",
-        ]
-    ]
 
-    # Format data as list of dicts. Each list element is a row in the dataframe
-    items = list(combined_df.T.to_dict().values())
+def kv3_combine(combined_df: pd.DataFrame, items_df: pd.DataFrame):
+    """Combine KV3 findings with department information and format them as items"""
+    items = enrich(items_df.to_dict("records"), combined_df, left_on="Afdeling", right_on="SDafdID", numeric=False)
+
+    # Format data as list of dicts
+    columns = {
+        "Tjenestenummer": "Tjenestenummer",
+        "Afdeling": "Afdeling",
+        "Institutionskode": "Institutionskode",
+        "Overenskomst": "Overenskomst",
+        "enhnavn": "Enhedsnavn",
+        "Navn": "Navn",
+        "afdtype_txt": "afdtype_txt",
+    }
+    items = [{name: item[column] for column, name in columns.items()} for item in items]
 
     return items
 
@@ -241,28 +262,27 @@ def kv3_dev(
     orchestrator_connection: OrchestratorConnection,
 ):
     """Ansættelser with wrong overenskomst based on departmentype"""
-    connection_string_mbu = orchestrator_connection.get_constant(
-        "DbConnectionString"
+    connection_string_mbu = orchestrator_cache.get_constant(
+        orchestrator_connection, "DbConnectionString"
     ).value
-    connection_string_faelles = orchestrator_connection.get_constant(
-        "FaellesDbConnectionString"
+    connection_string_faelles = orchestrator_cache.get_constant(
+        orchestrator_connection, "FaellesDbConnectionString"
     ).value
 
     # Load department types from LIS stamdata
     lis_stamdata = lis_enheder(
         connection_string=connection_string_mbu, afdtype=(2, 3, 4, 5, 11, 13)
     )
-    losid_tuple = tuple(i["losid"] for i in lis_stamdata)
+    losid_tuple = tuple(lis_stamdata["losid"].tolist())
 
     # Load corresponding SD department codes
-    sd_departments = sd_enheder(
+    sd_departments_df = sd_enheder(
         losid_tuple=losid_tuple, connection_string=connection_string_faelles
     )
 
     # Combine SD and LIS data
-    lis_stamdata_df = pd.DataFrame(lis_stamdata).rename(columns={"losid": "LOSID"})
+    lis_stamdata_df = lis_stamdata.rename(columns={"losid": "LOSID"})
     lis_stamdata_df["LOSID"] = lis_stamdata_df["LOSID"].astype(int)
-    sd_departments_df = pd.DataFrame(sd_departments)
     sd_departments_df["LOSID"] = sd_departments_df["LOSID"].astype(int)
 
     combined_df = pd.merge(
@@ -276,22 +296,21 @@ def kv3_dev(
             & ~(combined_df["SDafdID"].isna())
         )
     ]
-    dagtilbud_afd = tuple(dagtilbud_df["SDafdID"].values)
+    dagtilbud_afd = tuple(dagtilbud_df["SDafdID"].tolist())
 
     skole_df = combined_df[
         ((combined_df["afdtype"].isin([13])) & ~(combined_df["SDafdID"].isna()))
     ]
-    skole_afd = tuple(skole_df["SDafdID"].values)
+    skole_afd = tuple(skole_df["SDafdID"].tolist())
 
     # Collect ansættelser with wrong overenskomst
-    items = kv3_1_dev(
+    items_df = kv3_1_dev(
         connection_str=connection_string_faelles,
         skole_afd=skole_afd,
         dagtilbud_afd=dagtilbud_afd,
         accept_ovk_skole=accept_ovk_skole,
         accept_ovk_dag=accept_ovk_dag,
     )
-    items_df = pd.DataFrame(items)
 
     # # Get AF emails (probably just send to lønservice)
     # af_email = af_losid(connection_str=connection_string_mbu)
@@ -317,11 +336,37 @@ def kv3_dev(
     ]
 
     # Format data as list of dicts. Each list element is a row in the dataframe
-    items = list(combined_df.T.to_dict().values())
+    items = combined_df.to_dict("records")
 
     return items
 
 
+def kv2_pair_values(tillaeg_pair_index: dict):
+    """Render the KV2 pairs as parameterized rows for a VALUES table: (par_id, ovk, tillaegsnummer)
+
+    Returns:
+        tuple: (sql, params)
+    """
+    params = [
+        value
+        for number, partner in tillaeg_pair_index.items()
+        for value in (partner.par_id, partner.ovk, number)
+    ]
+    sql = ",\n                ".join(["(?, ?, ?)"] * (len(params) // 3))
+    return sql, params
+
+
+@cached_reference_data(
+    subset_argument="afdtype",
+    subset_column="afdtype",
+    widen=True,
+    fingerprint_sql="""
+        SELECT
+            COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(lisid, losid, enhnavn, afdtype, afdtype_txt))
+        FROM
+            [BuMasterdata].[dbo].[VIEW_MD_STAMDATA_AKTUEL]
+    """,
+)
 def lis_enheder(connection_string: str, afdtype: tuple | None = None):
     """Get the right departments from LIS stamdata"""
     sql = """
@@ -330,18 +375,27 @@ def lis_enheder(connection_string: str, afdtype: tuple | None = None):
         FROM
             [BuMasterdata].[dbo].[VIEW_MD_STAMDATA_AKTUEL]
     """
-    sql += (
-        f"""
+    params = []
+    if afdtype:
+        afdtype_sql, params = in_clause(afdtype)
+        sql += f"""
             WHERE
-                afdtype in {afdtype}
+                afdtype in {afdtype_sql}
         """
-        if afdtype
-        else ""
-    )
-    departments = get_items_from_query(connection_string=connection_string, query=sql)
+    departments = get_frame_from_query(connection_string=connection_string, query=sql, params=params)
     return departments
 
 
+@cached_reference_data(
+    subset_argument="losid_tuple",
+    subset_column="LOSID",
+    fingerprint_sql="""
+        SELECT
+            COUNT_BIG(*), CHECKSUM_AGG(BINARY_CHECKSUM(SDafdID, LOSID))
+        FROM
+            [Personale].[sd].[Organisation]
+    """,
+)
 def sd_enheder(connection_string: str, losid_tuple: tuple | None = None):
     """Get SDafdID from faellessql"""
     sql = """
@@ -350,18 +404,28 @@ def sd_enheder(connection_string: str, losid_tuple: tuple | None = None):
         FROM
             [Personale].[sd].[Organisation]
     """
-    sql += (
-        f"""
+    key_sets = None
+    if losid_tuple:
+        key_sets = {"losid": losid_tuple}
+        sql += f"""
             WHERE
-                LOSID in {losid_tuple}
+                LOSID in {key_set_sql("losid")}
         """
-        if losid_tuple
-        else ""
-    )
-    departments = get_items_from_query(connection_string=connection_string, query=sql)
+    departments = get_frame_from_query(connection_string=connection_string, query=sql, key_sets=key_sets)
     return departments
 
 
+@cached_reference_data(
+    # Includes the date, as the result depends on the STARTDATO/SLUTDATO window
+    fingerprint_sql="""
+        SELECT
+            CAST(GETDATE() AS date),
+            (SELECT COUNT_BIG(*) FROM [BuMasterdata].[dbo].[MD_ADM_FAELLESSKAB]),
+            (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(adm_faelles_id, lisid, STARTDATO, SLUTDATO)) FROM [BuMasterdata].[dbo].[MD_ADM_FAELLESSKAB]),
+            (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(lisid, losid, afdemail)) FROM [BuMasterdata].[dbo].[VIEW_MD_STAMDATA_AKTUEL])
+    """,
+    connection_argument="connection_str",
+)
 def af_losid(connection_str: str):
     """Get AF per LOSID"""
     sql = """
@@ -383,32 +447,36 @@ def af_losid(connection_str: str):
     LEFT JOIN
         [BuMasterdata].[dbo].[VIEW_MD_STAMDATA_AKTUEL] v2 ON t.lisid = v2.lisid
     """
-    af_email_kobling = get_items_from_query(connection_string=connection_str, query=sql)
+    af_email_kobling = get_frame_from_query(connection_string=connection_str, query=sql)
     return af_email_kobling
 
 
+def combine_for_receiver(items: list | None, orchestrator_connection: OrchestratorConnection, process: str):
+    """Combines items with AF emails if the notifications of the process are sent to the AF"""
+    if items and get_run_config(orchestrator_connection).af_receiver(process):
+        items = combine_with_af_email(
+            orchestrator_connection=orchestrator_connection, items=items
+        )
+
+    return items
+
+
 def combine_with_af_email(
-    orchestrator_connection: OrchestratorConnection, item_df: pd.DataFrame
+    orchestrator_connection: OrchestratorConnection, items: list
 ):
     """Combines items with AF emails from LIS database"""
 
-    connection_string_mbu = orchestrator_connection.get_constant(
-        "DbConnectionString"
+    connection_string_mbu = orchestrator_cache.get_constant(
+        orchestrator_connection, "DbConnectionString"
     ).value
 
-    af_email = af_losid(connection_str=connection_string_mbu)
-    af_email_df = pd.DataFrame(af_email).astype({"LOSID": int}, errors="ignore")
-    combined_df = pd.merge(left=item_df, right=af_email_df, on="LOSID")
-
-    lis_dep = lis_enheder(connection_string=connection_string_mbu)
-    lis_dep_df = (
-        pd.DataFrame(lis_dep)
-        .rename(columns={"losid": "LOSID"})
-        .astype({"LOSID": int}, errors="ignore")
+    results = fetch_concurrently(
+        af=partial(af_losid, connection_str=connection_string_mbu),
+        lis=partial(lis_enheder, connection_string=connection_string_mbu),
     )
-    combined_df = pd.merge(left=combined_df, right=lis_dep_df, on="LOSID")
 
-    items = list(combined_df.T.to_dict().values())
+    items = enrich(items, results["af"], left_on="LOSID")
+    items = enrich(items, results["lis"].rename(columns={"losid": "LOSID"}), left_on="LOSID")
 
     return items
 
@@ -421,40 +489,19 @@ def kv3_1_dev(
     accept_ovk_skole: tuple,
 ):
     """Get wrong overenskomst in skole and dagtilbud respectively"""
-    accept_dag_str = (
-        f"and Overenskomst not in {accept_ovk_dag}" if len(accept_ovk_dag) != 0 else ""
+    dagtilbud_df = wrong_overenskomst_in(
+        connection_str=connection_str,
+        afdelinger=dagtilbud_afd,
+        overenskomst_sql="and SUBSTRING(Overenskomst,1,1) = '7' and Overenskomst not in (76001, 76101)",
+        accept_ovk=accept_ovk_dag,
     )
-    accept_skole_str = (
-        f"and Overenskomst not in {accept_ovk_skole}"
-        if len(accept_ovk_skole) != 0
-        else ""
+    skole_df = wrong_overenskomst_in(
+        connection_str=connection_str,
+        afdelinger=skole_afd,
+        overenskomst_sql="and SUBSTRING(Overenskomst,1,1) = '4' and Overenskomst not in (46001, 46101)",
+        accept_ovk=accept_ovk_skole,
     )
-    sql = f"""
-        SELECT
-            ans.Tjenestenummer, ans.Overenskomst, ans.Afdeling, ans.Institutionskode, perstam.Navn, ans.Startdato, ans.Slutdato, ans.Statuskode
-        FROM
-            [Personale].[sd_magistrat].[Ansættelse_mbu] ans
-            left join [Personale].[sd].[personStam] as perstam
-            on ans.CPR = perstam.CPR
-        WHERE
-            ((
-                Afdeling in {dagtilbud_afd}
-                and SUBSTRING(Overenskomst,1,1) = '7'
-                and Overenskomst not in (76001, 76101)
-                {accept_dag_str}
-            )
-            or
-            (
-                Afdeling in {skole_afd}
-                and SUBSTRING(Overenskomst,1,1) = '4'
-                and Overenskomst not in (46001, 46101)
-                {accept_skole_str}
-            ))
-            and Statuskode in ('1', '3', '5')
-            and Startdato <= GETDATE()
-            and Slutdato > GETDATE()
-    """
-    items = get_items_from_query(connection_string=connection_str, query=sql)
+    items = pd.concat([dagtilbud_df, skole_df], ignore_index=True)
     return items
 
 
@@ -466,14 +513,34 @@ def kv3_1(
     accept_ovk_dag: tuple,
 ):
     """Get wrong overenskomst in skole and dagtilbud respectively"""
-    accept_dag_str = (
-        f"and Overenskomst not in {accept_ovk_dag}" if len(accept_ovk_dag) != 0 else ""
+    dagtilbud_df = wrong_overenskomst_in(
+        connection_str=connection_str,
+        afdelinger=dagtilbud_afd,
+        overenskomst_sql="and Overenskomst in (76001, 76101, 77001)",
+        accept_ovk=accept_ovk_dag,
     )
-    accept_skole_str = (
-        f"and Overenskomst not in {accept_ovk_skole}"
-        if len(accept_ovk_skole) != 0
-        else ""
+    skole_df = wrong_overenskomst_in(
+        connection_str=connection_str,
+        afdelinger=skole_afd,
+        overenskomst_sql="and Overenskomst in (46001, 46101)",
+        accept_ovk=accept_ovk_skole,
     )
+    items = pd.concat([dagtilbud_df, skole_df], ignore_index=True)
+    return items
+
+
+def wrong_overenskomst_in(
+    connection_str: str,
+    afdelinger: tuple,
+    overenskomst_sql: str,
+    accept_ovk: tuple,
+):
+    """Get active ansættelser in the given departments with an overenskomst matching `overenskomst_sql`,
+    except the accepted overenskomster. The departments are bulk loaded as a key set"""
+    accept_str, params = "", []
+    if len(accept_ovk) != 0:
+        accept_sql, params = in_clause(accept_ovk)
+        accept_str = f"and Overenskomst not in {accept_sql}"
     sql = f"""
         SELECT
             ans.Tjenestenummer, ans.Overenskomst, ans.Afdeling, ans.Institutionskode, perstam.Navn, ans.Startdato, ans.Slutdato, ans.Statuskode
@@ -482,22 +549,16 @@ def kv3_1(
             left join [Personale].[sd].[personStam] as perstam
             on ans.CPR = perstam.CPR
         WHERE
-            ((
-                Afdeling in {dagtilbud_afd}
-                and Overenskomst in (76001, 76101, 77001)
-                {accept_dag_str}
-            )
-            or
-            (
-                Afdeling in {skole_afd}
-                and Overenskomst in (46001, 46101)
-                {accept_skole_str}
-            ))
+            Afdeling in {key_set_sql("afdelinger")}
+            {overenskomst_sql}
+            {accept_str}
             and Statuskode in ('1', '3', '5')
             and Startdato <= GETDATE()
             and Slutdato > GETDATE()
     """
-    items = get_items_from_query(connection_string=connection_str, query=sql)
+    items = get_frame_from_query(
+        connection_string=connection_str, query=sql, params=params, key_sets={"afdelinger": afdelinger}
+    )
     return items
 
 
@@ -506,6 +567,7 @@ def kv4(orchestrator_connection: OrchestratorConnection, leder_overenskomst: tup
     CASE: Ledere som mangler lås på anciennitetsdato.
     """
 
+    leder_sql, params = in_clause(leder_overenskomst)
     sql = f"""
         SELECT
             ans.Tjenestenummer, ans.Overenskomst, ans.Afdeling, perstam.Navn, ans.Institutionskode,
@@ -518,43 +580,237 @@ def kv4(orchestrator_connection: OrchestratorConnection, leder_overenskomst: tup
             left join [Personale].[sd].[Organisation] org
                 on ans.Afdeling = org.SDafdID
         WHERE
-            ans.Overenskomst in {leder_overenskomst}
+            ans.Overenskomst in {leder_sql}
             and ans.Startdato <= GETDATE() and ans.Slutdato > GETDATE() and ans.Statuskode in ('1', '3', '5')
             and cast(ans.Anciennitetsdato as date) != '9999-12-31'
     """
 
-    oc_args = json.loads(orchestrator_connection.process_arguments)
-    receiver = oc_args.get("notification_receiver", None).upper()
-    af_receiver = receiver == "AF"
+    connection_string = orchestrator_cache.get_constant(
+        orchestrator_connection, "FaellesDbConnectionString"
+    ).value
+    items = get_items_from_query(connection_string, sql, params)
+    items = combine_for_receiver(items, orchestrator_connection, "KV4")
+
+    return items
+
+
+def active_employments(connection_string: str, incremental: bool = False):
+    """
+    Active employments with the person and organisation information used by the controls.
+    Fetched once in ALL mode and shared by the controls evaluated in memory.
+
+    In incremental mode only a checksum per employment is fetched. Employments that are new, changed,
+    or whose Startdato/Slutdato window just opened are fetched, and the rest are reused from the last run.
+    Employments whose window closed are no longer active, so they are dropped.
+    The local copy holds no names, so Navn is empty in incremental mode. See add_employee_names
+    """
+    columns = """
+            ans.AnsættelsesID, ans.Tjenestenummer, ans.Overenskomst, ans.Afdeling, ans.Institutionskode,
+            ans.Startdato, ans.Slutdato, ans.Statuskode, ans.Anciennitetsdato, org.LOSID,
+            IIF(perstam.CPR IS NULL, 0, 1) AS HarPersonStam,
+            CASE WHEN cast(ans.Anciennitetsdato as date) != '9999-12-31' THEN 1 ELSE 0 END AS AnciennitetIkkeLaast
+    """
+    sql = """
+        FROM
+            [Personale].[sd_magistrat].[Ansættelse_mbu] ans
+            left join [Personale].[sd].[personStam] perstam
+                on ans.CPR = perstam.CPR
+            left join [Personale].[sd].[Organisation] org
+                on ans.Afdeling = org.SDafdID
+        WHERE
+            ans.Slutdato > GETDATE() and ans.Startdato <= GETDATE()
+            and ans.Statuskode in ('1', '3', '5')
+    """
+    if not incremental:
+        return get_frame_from_query(connection_string=connection_string, query=f"SELECT perstam.Navn, {columns} {sql}")
+    sql = f"SELECT {columns} {sql}"
 
-    connection_string = orchestrator_connection.get_constant(
-        "FaellesDbConnectionString"
+    # The join may give several rows per employment, so the checksums are aggregated with the row count
+    checksum_sql = """
+        SELECT
+            ans.AnsættelsesID,
+            CONCAT(
+                CHECKSUM_AGG(BINARY_CHECKSUM(
+                    ans.Tjenestenummer, ans.Overenskomst, ans.Afdeling, ans.Institutionskode, perstam.CPR,
+                    ans.Startdato, ans.Slutdato, ans.Statuskode, ans.Anciennitetsdato, org.LOSID
+                )),
+                '-', COUNT(*)
+            ) AS checksum
+        FROM
+            [Personale].[sd_magistrat].[Ansættelse_mbu] ans
+            left join [Personale].[sd].[personStam] perstam
+                on ans.CPR = perstam.CPR
+            left join [Personale].[sd].[Organisation] org
+                on ans.Afdeling = org.SDafdID
+        WHERE
+            ans.Slutdato > GETDATE() and ans.Startdato <= GETDATE()
+            and ans.Statuskode in ('1', '3', '5')
+        GROUP BY
+            ans.AnsættelsesID
+    """
+    changed_sql = sql + f"""
+            and ans.AnsættelsesID in {key_set_sql("changed")}
+    """
+    employments = incremental_store.refresh(
+        name="active_employments",
+        source=connection_string,
+        key_column="AnsættelsesID",
+        checksums=get_frame_from_query(connection_string=connection_string, query=checksum_sql),
+        fetch_all=partial(get_frame_from_query, connection_string=connection_string, query=sql),
+        fetch_keys=lambda keys: get_frame_from_query(
+            connection_string=connection_string, query=changed_sql, key_sets={"changed": keys}
+        ),
+    )
+    return employments.assign(Navn=None)
+
+
+def add_employee_names(connection_string: str, items_per_control: list):
+    """
+    Fill in Navn of the findings of the incremental employment scan, which doesn't store names.
+    The names are looked up for the findings only, by Tjenestenummer and Institutionskode
+    """
+    findings = [item for items in items_per_control for item in items or []]
+    if not findings:
+        return
+
+    sql = f"""
+        SELECT
+            ans.Tjenestenummer, ans.Institutionskode, perstam.Navn
+        FROM
+            [Personale].[sd_magistrat].[Ansættelse_mbu] ans
+            join [Personale].[sd].[personStam] perstam
+                on ans.CPR = perstam.CPR
+        WHERE
+            ans.Tjenestenummer in {key_set_sql("tjenestenumre")}
+    """
+    columns = get_columns_from_query(
+        connection_string, sql, key_sets={"tjenestenumre": list({item["Tjenestenummer"] for item in findings})}
+    )
+    names = {
+        (str(tjenestenummer), institutionskode): navn
+        for tjenestenummer, institutionskode, navn in zip(columns["Tjenestenummer"], columns["Institutionskode"], columns["Navn"])
+    }
+    for item in findings:
+        item["Navn"] = names.get((str(item["Tjenestenummer"]), item.get("Institutionskode")))
+
+
+def kv1_evaluate(employments: pd.DataFrame, overenskomst: int, orchestrator_connection: OrchestratorConnection):
+    """KV1 evaluated on the shared employment scan. Same result as kv1"""
+    overenskomster = pd.to_numeric(employments["Overenskomst"], errors="coerce")
+    findings = employments[
+        (overenskomster == overenskomst)
+        & employments["Institutionskode"].notna()
+        & (employments["Institutionskode"] != "XC")
+        & (employments["HarPersonStam"] == 1)
+    ]
+    items = findings[
+        ["Tjenestenummer", "Overenskomst", "Afdeling", "Institutionskode", "Navn", "Startdato", "Slutdato", "Statuskode", "LOSID"]
+    ].to_dict("records")
+
+    return combine_for_receiver(items or None, orchestrator_connection, "KV1")
+
+
+def kv3_evaluate(
+    employments: pd.DataFrame,
+    accept_ovk_dag: tuple,
+    accept_ovk_skole: tuple,
+    orchestrator_connection: OrchestratorConnection,
+):
+    """KV3 evaluated on the shared employment scan. Same result as kv3"""
+    combined_df, dagtilbud_afd, skole_afd = kv3_departments(orchestrator_connection)
+
+    # The scan joins Organisation, which kv3_1 does not. Drop LOSID and any rows duplicated by the join
+    employments = employments.drop(columns=["LOSID"]).drop_duplicates()
+    overenskomster = pd.to_numeric(employments["Overenskomst"], errors="coerce")
+    dagtilbud = (
+        employments["Afdeling"].isin(dagtilbud_afd)
+        & overenskomster.isin([76001, 76101, 77001])
+        & ~overenskomster.isin(accept_ovk_dag)
+    )
+    skole = (
+        employments["Afdeling"].isin(skole_afd)
+        & overenskomster.isin([46001, 46101])
+        & ~overenskomster.isin(accept_ovk_skole)
+    )
+    items_df = employments[dagtilbud | skole][
+        ["Tjenestenummer", "Overenskomst", "Afdeling", "Institutionskode", "Navn", "Startdato", "Slutdato", "Statuskode"]
+    ]
+
+    return kv3_combine(combined_df, items_df)
+
+
+def kv4_evaluate(employments: pd.DataFrame, leder_overenskomst: tuple, orchestrator_connection: OrchestratorConnection):
+    """KV4 evaluated on the shared employment scan. Same result as kv4"""
+    overenskomster = pd.to_numeric(employments["Overenskomst"], errors="coerce")
+    findings = employments[
+        overenskomster.isin(leder_overenskomst)
+        & (employments["AnciennitetIkkeLaast"] == 1)
+        & (employments["HarPersonStam"] == 1)
+    ]
+    items = findings[
+        ["Tjenestenummer", "Overenskomst", "Afdeling", "Navn", "Institutionskode", "Anciennitetsdato", "LOSID"]
+    ].to_dict("records")
+
+    return combine_for_receiver(items or None, orchestrator_connection, "KV4")
+
+
+def all_controls(controls: tuple, orchestrator_connection: OrchestratorConnection):
+    """
+    Runs several controls in one robot run.
+    Controls with an "evaluate" function in PROCESS_PROCEDURE_DICT share one scan of the active employments,
+    which is refreshed incrementally if "incremental" is set in the process arguments.
+    Other controls run their own procedure.
+
+    Arguments:
+        controls (tuple): The processes to run, e.g. ("KV1", "KV2")
+
+    Returns:
+        dict: Items per process
+    """
+    connection_string = orchestrator_cache.get_constant(
+        orchestrator_connection, "FaellesDbConnectionString"
     ).value
-    items = get_items_from_query(connection_string, sql)
-    if items and af_receiver:
-        item_df = pd.DataFrame(items).astype({"LOSID": int}, errors="ignore")
+    incremental = get_run_config(orchestrator_connection).incremental
+
+    employments = None
+    results = {}
+    evaluated = []
+    for control in controls:
+        process_procedure = PROCESS_PROCEDURE_DICT[control]
+        evaluate = process_procedure.get("evaluate")
+        if evaluate:
+            if employments is None:
+                employments = active_employments(connection_string, incremental)
+            items = evaluate(employments, **process_procedure["parameters"], orchestrator_connection=orchestrator_connection)
+            evaluated.append(items)
+        else:
+            items = process_procedure["procedure"](**process_procedure["parameters"], orchestrator_connection=orchestrator_connection)
+        orchestrator_connection.log_trace(f"{control}: {len(items) if items else 0} items")
+        results[control] = items
 
-        items = combine_with_af_email(
-            orchestrator_connection=orchestrator_connection, item_df=item_df
-        )
+    if incremental:
+        add_employee_names(connection_string, evaluated)
 
-    return items
+    return results
 
 
 # Dictionary with process specific functions and parameters
 PROCESS_PROCEDURE_DICT = {
     "KV1": {
         "procedure": kv1,
+        "evaluate": kv1_evaluate,
+        "af_receiver": True,  # Findings are combined with AF emails, so they can be sent to the AF
         "parameters": {
             "overenskomst": 47302
         },  # Overenskomst in which all employments should have INSTKODE = XC
     },
     "KV2": {
         "procedure": kv2,
-        "parameters": {"tillaegsnr_par": tillaeg_pairs},
+        "parameters": {"tillaeg_pair_index": tillaeg_index},
     },
     "KV3": {
         "procedure": kv3,
+        "evaluate": kv3_evaluate,
         "parameters": {
             "accept_ovk_dag": (),  # Overenskomster starting with "7" but accepted in dagtilbud/UIAA
             "accept_ovk_skole": (
@@ -595,8 +851,16 @@ PROCESS_PROCEDURE_DICT = {
     },
     "KV4": {
         "procedure": kv4,
+        "evaluate": kv4_evaluate,
+        "af_receiver": True,
         "parameters": {
             "leder_overenskomst": (45082, 45081, 46901, 45101, 47201),
         },
     },
+    "ALL": {
+        "procedure": all_controls,
+        "parameters": {
+            "controls": ("KV1", "KV2", "KV3", "KV4"),
+        },  # Each control's findings are put in its own queue
+    },
 }
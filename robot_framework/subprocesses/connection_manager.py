@@ -0,0 +1,128 @@
+"""Module for pooled database connections that are reused for the whole robot run"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+import pyodbc
+
+from robot_framework import config
+
+
+class ConnectionManager:
+    """
+    Keeps pyodbc connections open, keyed by connection string.
+
+    Connections are checked out one caller at a time, so a connection is never shared
+    between threads. Idle connections are health checked before reuse and replaced if broken.
+    """
+
+    def __init__(self, health_check_interval: float = config.DB_HEALTH_CHECK_INTERVAL):
+        self.health_check_interval = health_check_interval
+        self._idle: dict[str, list[tuple[pyodbc.Connection, float]]] = {}
+        self._cursors: dict[int, pyodbc.Cursor] = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "connects": 0,
+            "reuses": 0,
+            "reconnects": 0,
+            "connect_time": 0.0,
+            "execute_time": 0.0,
+        }
+
+    @contextmanager
+    def connection(self, connection_string: str):
+        """Check out a connection for `connection_string`. It is returned to the pool afterwards,
+        unless the caller failed, in which case it is closed as its state is unknown."""
+        conn = self._checkout(connection_string)
+        succeeded = False
+        try:
+            yield conn
+            succeeded = True
+        finally:
+            if succeeded:
+                with self._lock:
+                    self._idle.setdefault(connection_string, []).append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+
+    @contextmanager
+    def cursor(self, connection_string: str):
+        """Check out a connection and yield the cursor kept with it.
+        Reusing the cursor lets pyodbc skip re-preparing a parameterized query that is executed again."""
+        with self.connection(connection_string) as conn:
+            with self._lock:
+                cursor = self._cursors.get(id(conn))
+            if cursor is None:
+                cursor = conn.cursor()
+                with self._lock:
+                    self._cursors[id(conn)] = cursor
+            yield cursor
+
+    def add_execute_time(self, seconds: float):
+        """Register time spent executing queries and fetching rows"""
+        with self._lock:
+            self.stats["execute_time"] += seconds
+
+    def close_all(self):
+        """Close all idle connections"""
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn, _ in conns]
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return (
+            f"DB connections: {stats['connects']} connects, {stats['reuses']} reuses, {stats['reconnects']} reconnects, "
+            f"{stats['connect_time']:.2f}s connecting, {stats['execute_time']:.2f}s executing"
+        )
+
+    def _checkout(self, connection_string: str):
+        while True:
+            with self._lock:
+                idle = self._idle.get(connection_string)
+                if not idle:
+                    break
+                conn, last_used = idle.pop()
+
+            if time.monotonic() - last_used < self.health_check_interval or _is_alive(conn):
+                with self._lock:
+                    self.stats["reuses"] += 1
+                return conn
+
+            self._discard(conn)
+            with self._lock:
+                self.stats["reconnects"] += 1
+
+        start = time.perf_counter()
+        # Autocommit, so pooled connections don't hold an open transaction between queries
+        conn = pyodbc.connect(connection_string, autocommit=True)
+        with self._lock:
+            self.stats["connects"] += 1
+            self.stats["connect_time"] += time.perf_counter() - start
+        return conn
+
+    def _discard(self, conn: pyodbc.Connection):
+        with self._lock:
+            self._cursors.pop(id(conn), None)
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+
+def _is_alive(conn: pyodbc.Connection):
+    """Cheap round trip to check that the server still accepts the connection"""
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1").fetchone()
+        return True
+    except pyodbc.Error:
+        return False
+
+
+# Shared by all queries in the robot run. Closed in reset.close_all
+connection_manager = ConnectionManager()
@@ -0,0 +1,85 @@
+"""Module for grouping findings into digest queue elements, one per receiver"""
+
+import json
+
+from robot_framework import config
+from robot_framework.subprocesses.helper_functions import format_item
+
+# Fields of a finding shown in the digest table, per process
+DIGEST_FIELDS = {
+    "KV1": ["Tjenestenummer", "Afdeling", "Institutionskode", "Overenskomst"],
+    "KV2": ["Tjenestenummer", "Navn", "Overenskomst", "Afdeling", "Enhedsnavn", "Institutionskode", "Tillægsnummer", "Tillægsnavn"],
+    "KV3": ["Tjenestenummer", "Navn", "Afdeling", "Enhedsnavn", "afdtype_txt", "Institutionskode", "Overenskomst"],
+    "KV3-DEV": ["Tjenestenummer", "Navn", "Afdeling", "Enhedsnavn", "afdtype_txt", "Institutionskode", "Overenskomst"],
+    "KV4": ["Tjenestenummer", "Navn", "Afdeling", "Institutionskode", "Overenskomst"],
+}
+
+
+def build_digests(items_per_process: dict, receiver_field: str | None = None):
+    """
+    Group findings into digests, one per receiver. A digest lists its findings as a table with
+    a "KV" column, so findings of several processes can share a digest.
+
+    Queue element data is limited to QUEUE_DATA_MAX_LENGTH characters, so a digest that is too
+    large is split into parts, each sent as its own message.
+
+    Args:
+        items_per_process: Findings keyed by process, e.g. {"KV1": [...]}
+        receiver_field: Field holding the receiver of each finding, e.g. "AF_email". If None all findings go to the same receiver
+
+    Returns:
+        list[str]: The data of the digest queue elements as json strings
+    """
+    columns = ["KV"] + list(dict.fromkeys(
+        field for process in items_per_process for field in DIGEST_FIELDS[process]
+    ))
+    # Reminders of findings notified before (see notification_ledger)
+    if any("Rykker" in item for items in items_per_process.values() for item in items or []):
+        columns.append("Rykker")
+
+    rows_per_receiver = {}
+    for process, items in items_per_process.items():
+        for item in items or []:
+            item = format_item(item)
+            receiver = item.get(receiver_field) if receiver_field else None
+            row = [process] + [item.get(column) for column in columns[1:]]
+            rows_per_receiver.setdefault(receiver, []).append(row)
+
+    digests = []
+    for receiver, rows in rows_per_receiver.items():
+        header = {receiver_field: receiver} if receiver_field else {}
+        parts = _split_rows(header, columns, rows)
+        for i, part in enumerate(parts):
+            digests.append(_dumps({**header, "part": [i + 1, len(parts)], "columns": columns, "rows": part}))
+
+    return digests
+
+
+def _split_rows(header: dict, columns: list, rows: list):
+    """Split rows into parts that fit in a queue element"""
+    def fits(part_rows):
+        # The part numbers are at most a few digits, so reserve room for them
+        return len(_dumps({**header, "part": [99, 99], "columns": columns, "rows": part_rows})) <= config.QUEUE_DATA_MAX_LENGTH
+
+    parts = [[]]
+    for row in rows:
+        if fits(parts[-1] + [row]):
+            parts[-1].append(row)
+        elif fits([row]):
+            parts.append([row])
+        else:
+            raise ValueError(f"Finding too large for a queue element: {row}")
+    return parts
+
+
+def _dumps(data: dict):
+    return json.dumps(data, ensure_ascii=False)
+
+
+def digest_findings(element_data: dict):
+    """The findings of a digest as dicts, grouped by process"""
+    findings = {}
+    for row in element_data["rows"]:
+        finding = dict(zip(element_data["columns"], row))
+        findings.setdefault(finding["KV"], []).append(finding)
+    return findings
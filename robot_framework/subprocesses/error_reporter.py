@@ -0,0 +1,101 @@
+"""Module for sending error reports in the background, so a failing queue element doesn't wait for the report"""
+
+import queue
+import threading
+import time
+import traceback
+
+from robot_framework import config
+from robot_framework import error_screenshot
+
+
+class ErrorReporter:
+    """
+    Sends error screenshot e-mails from one background thread.
+
+    The screen is grabbed when the error is reported, and compressed and sent by the background thread.
+    An error with the same type and message as one reported within `dedupe_seconds` is not reported again,
+    so a burst of elements failing the same way sends one report. At most `max_pending` reports wait
+    to be sent. Further reports are dropped until the queue has room.
+    """
+
+    def __init__(self, dedupe_seconds: float = config.ERROR_REPORT_DEDUPE_SECONDS, max_pending: int = config.ERROR_REPORT_MAX_PENDING):
+        self.dedupe_seconds = dedupe_seconds
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._reported: dict[tuple[str, str], float] = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self.stats = {"sent": 0, "duplicates": 0, "dropped": 0, "failed": 0}
+
+    def report(self, to_address: str | list[str], error: Exception, process_name: str):
+        """
+        Queue an error report. Must be called where the error is handled, so its traceback is available.
+
+        Returns:
+            bool: Whether the report was queued
+        """
+        key = (type(error).__name__, str(error))
+        now = time.monotonic()
+        with self._lock:
+            reported = self._reported.get(key)
+            if reported is not None and now - reported < self.dedupe_seconds:
+                self.stats["duplicates"] += 1
+                return False
+            if self._queue.full():
+                self.stats["dropped"] += 1
+                return False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="error-reporter", daemon=True)
+                self._thread.start()
+            self._reported[key] = now
+
+        # Grabbed here, as the screen may have changed, e.g. by a reset, by the time the report is sent
+        screen = error_screenshot.grab_screen()
+        try:
+            self._queue.put_nowait((to_address, error, process_name, traceback.format_exc(), screen))
+        except queue.Full:
+            with self._lock:
+                self.stats["dropped"] += 1
+                self._reported.pop(key, None)
+            return False
+        return True
+
+    def flush(self, timeout: float = config.ERROR_REPORT_FLUSH_TIMEOUT):
+        """Wait up to `timeout` seconds for the queued reports to be sent. Returns whether all were sent"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                print(f"{self._queue.unfinished_tasks} error reports not sent within {timeout} seconds")
+                return False
+            time.sleep(0.1)
+        return True
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return (
+            f"Error reports: {stats['sent']} sent, {stats['duplicates']} duplicates skipped, "
+            f"{stats['dropped']} dropped, {stats['failed']} failed"
+        )
+
+    def _run(self):
+        while True:
+            to_address, error, process_name, trace, screen = self._queue.get()
+            try:
+                error_screenshot.send_error_screenshot(to_address, error, process_name, trace, screen)
+                self._count("sent")
+            # A failing report must not stop the reporter thread
+            # pylint: disable-next = broad-exception-caught
+            except Exception as e:
+                print(f"Could not send error report: {str(e)}")
+                self._count("failed")
+            finally:
+                self._queue.task_done()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+
+# Shared by the error handling in the robot run
+error_reporter = ErrorReporter()
@@ -1,7 +1,17 @@
 """Module for helper functions"""
+import math
+import numbers
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from decimal import Decimal
+
+import pandas as pd
 import pyodbc
 
+from robot_framework import config
+from robot_framework.subprocesses.connection_manager import connection_manager
+
 
 def format_item(item: dict):
     """Format dates in dict, e.g. for json parsing"""
@@ -19,49 +29,80 @@ def format_item(item: dict):
 #     return match_ovk
 
 
-def find_pair_info(data: dict, number: int):
+def in_clause(values) -> tuple[str, list]:
     """
-    Searches for `number` (int) in `data['pair']`. If found, returns the other element from the pair
-    and the corresponding name from `pair_names`.
+    Render a parameterized IN list, e.g. "(?, ?, ?)", together with its parameters.
+
+    The list is padded with its last value up to the next power of two, so lists of varying
+    length share a few statement shapes and SQL Server can reuse the cached plans.
+    An empty list renders as "(NULL)", which matches nothing with IN. Do not use it with NOT IN.
 
     Args:
-        data (dict): Dictionary with keys:
-                     - 'ovk' (str)
-                     - 'pair' (tuple of two elements)
-                     - 'pair_names' (tuple of two elements)
-        number (int): Number to search for in the pair
+        values: The values to put in the list
 
     Returns:
-        tuple: (other_value, corresponding_name) if found, else None
+        tuple: (sql, params)
     """
-    pair = data.get('pair')
-    pair_names = data.get('pair_names')
+    values = list(values)
+    if not values:
+        return "(NULL)", []
+    if len(values) > config.DB_MAX_PARAMETERS:
+        raise ValueError(f"IN list with {len(values)} values exceeds the limit of {config.DB_MAX_PARAMETERS} parameters")
 
-    if isinstance(pair, tuple) and isinstance(pair_names, tuple) and len(pair) == 2 and len(pair_names) == 2:
-        if number in pair:
-            index = pair.index(number)
-            other_index = 1 - index
-            return pair[other_index], pair_names[other_index]
+    size = min(1 << (len(values) - 1).bit_length(), config.DB_MAX_PARAMETERS)
+    values += [values[-1]] * (size - len(values))
+    return f"({', '.join('?' * size)})", values
 
-    return None
 
+def key_set_sql(name: str) -> str:
+    """
+    SQL for a key set passed to the query functions with `key_sets`, to be used as `column in {key_set_sql(name)}`.
+    The keys are bulk loaded into the session temp table #<name>, or substituted by chunked IN lists
+    if temp tables are not available.
+    """
+    if not name.isidentifier():
+        raise ValueError(f"Invalid key set name: {name}")
+    return f"(SELECT key_value FROM #{name})"
 
-def get_items_from_query(connection_string, query: str):
-    """Executes given sql query and returns rows from its SELECT statement"""
-    result = []
-    try:
-        with pyodbc.connect(connection_string) as conn:
-            with conn.cursor() as cursor:
 
-                cursor.execute(query)
+# Connection strings where creating temp tables failed. Key sets fall back to chunked IN lists for these
+_temp_tables_denied = set()
 
-                rows = cursor.fetchall()
 
-                # Get column names from cursor description
-                columns = [column[0] for column in cursor.description]
+def iter_query_batches(connection_string: str, query: str, params: list | None = None, arraysize: int = config.DB_FETCH_ARRAYSIZE, key_sets: dict | None = None):
+    """
+    Executes given sql query and yields its rows in batches fetched with `cursor.fetchmany`.
 
-                # Convert to list of dictionaries
-                result = [dict(zip(columns, row)) for row in rows]
+    Args:
+        connection_string: Connection string for pyodbc connection
+        query: The SELECT query to run, with ? placeholders for parameters
+        params: Values for the ? placeholders in the query
+        arraysize: Number of rows fetched per round trip
+        key_sets: Key lists referenced in the query with `key_set_sql(name)`, keyed by name.
+            Each key set must narrow the whole result (e.g. AND'ed in the WHERE clause), since the chunked
+            fallback runs the query once per combination of chunks and concatenates the results
+
+    Yields:
+        tuple: (columns, rows) where columns is the list of column names and rows is a list of pyodbc rows.
+            An empty result yields a single empty batch, so the columns are still known
+    """
+    try:
+        with connection_manager.cursor(connection_string) as cursor:
+            cursor.arraysize = arraysize
+            statements = [(query, list(params or []))]
+
+            loaded = False
+            if key_sets:
+                key_sets = {name: _key_values(values) for name, values in key_sets.items()}
+                loaded = _load_key_sets(cursor, connection_string, key_sets)
+                if not loaded:
+                    statements = _chunk_key_sets(query, list(params or []), key_sets)
+
+            for statement, statement_params in statements:
+                yield from _fetch_batches(cursor, statement, statement_params, arraysize)
+
+            if loaded:
+                cursor.execute("".join(f"DROP TABLE IF EXISTS #{name};" for name in key_sets))
 
     except pyodbc.Error as e:
         print(f"Database error: {str(e)}")
@@ -75,7 +116,223 @@ def get_items_from_query(connection_string, query: str):
         print(f"An unexpected error occurred: {str(e)}")
         raise e
 
+
+def _fetch_batches(cursor: pyodbc.Cursor, query: str, params: list, arraysize: int):
+    start = time.perf_counter()
+
+    if params:
+        cursor.execute(query, params)
+    else:
+        cursor.execute(query)
+
+    # Get column names from cursor description
+    columns = [column[0] for column in cursor.description]
+
+    rows = cursor.fetchmany(arraysize)
+    connection_manager.add_execute_time(time.perf_counter() - start)
+    yield columns, rows
+
+    while rows:
+        start = time.perf_counter()
+        rows = cursor.fetchmany(arraysize)
+        connection_manager.add_execute_time(time.perf_counter() - start)
+        if rows:
+            yield columns, rows
+
+
+def _load_key_sets(cursor: pyodbc.Cursor, connection_string: str, key_sets: dict):
+    """Bulk insert the key sets into session temp tables. Returns False if temp tables are not available"""
+    if not config.DB_USE_TEMP_TABLES or connection_string in _temp_tables_denied:
+        return False
+
+    start = time.perf_counter()
+    try:
+        for name, values in key_sets.items():
+            if all(_is_integer(value) for value in values):
+                sql_type = "BIGINT"
+            else:
+                # Temp tables get the collation of tempdb. Comparing with a column of another collation fails with error 468
+                sql_type = "NVARCHAR(255) COLLATE DATABASE_DEFAULT"
+                # Keys that differ only by type, e.g. 1 and "1", are the same key in the table
+                values = list(dict.fromkeys(str(value) for value in values))
+
+            cursor.execute(f"DROP TABLE IF EXISTS #{name}; CREATE TABLE #{name} (key_value {sql_type} PRIMARY KEY)")
+            if values:
+                cursor.fast_executemany = True
+                cursor.executemany(f"INSERT INTO #{name} (key_value) VALUES (?)", [(value,) for value in values])
+    except pyodbc.Error as e:
+        print(f"Temp tables not available, using chunked IN lists instead: {str(e)}")
+        if _is_permission_error(e):
+            # Only a missing permission is permanent. Other errors fall back for this query only
+            _temp_tables_denied.add(connection_string)
+        return False
+    finally:
+        connection_manager.add_execute_time(time.perf_counter() - start)
+
+    return True
+
+
+def _is_integer(value):
+    """Whether a key is an integer, including numpy integers from DataFrames. Booleans are not keys"""
+    return isinstance(value, numbers.Integral) and not isinstance(value, bool)
+
+
+def _key_values(values):
+    """The distinct keys of a key set. Integers, e.g. numpy integers, are converted to int, which pyodbc accepts"""
+    return list(dict.fromkeys(int(value) if _is_integer(value) else value for value in values))
+
+
+def _is_permission_error(error: pyodbc.Error):
+    """Whether a database error is a missing permission, e.g. SQL Server error 262 'CREATE TABLE permission denied'"""
+    message = str(error).lower()
+    return "permission" in message or "(262)" in message
+
+
+def _chunk_key_sets(query: str, params: list, key_sets: dict):
+    """Substitute each key set with chunked IN lists. Returns a statement per combination of chunks"""
+    chunk_size = config.DB_IN_LIST_CHUNK_SIZE
+    statements = [(query, params)]
+    for name, values in key_sets.items():
+        marker = key_set_sql(name)
+        chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)] or [[]]
+        chunked_statements = []
+        for statement, statement_params in statements:
+            if statement.count(marker) != 1:
+                raise ValueError(f"Key set {name} must be used exactly once in the query")
+            # Insert the chunk parameters after the placeholders that precede the key set
+            position = statement.split(marker)[0].count("?")
+            for chunk in chunks:
+                chunk_sql, chunk_params = in_clause(chunk)
+                chunked_statements.append((
+                    statement.replace(marker, chunk_sql),
+                    statement_params[:position] + chunk_params + statement_params[position:]
+                ))
+        statements = chunked_statements
+    return statements
+
+
+def get_items_from_query(connection_string, query: str, params: list | None = None):
+    """Executes given sql query and returns rows from its SELECT statement"""
+    result = []
+    for columns, rows in iter_query_batches(connection_string, query, params):
+        # Convert to list of dictionaries
+        result.extend(dict(zip(columns, row)) for row in rows)
+
     if len(result) == 0:
         return None
 
     return result
+
+
+def get_columns_from_query(connection_string: str, query: str, params: list | None = None, arraysize: int = config.DB_FETCH_ARRAYSIZE, key_sets: dict | None = None):
+    """
+    Executes given sql query and returns the result as column arrays, without building a dict per row.
+
+    Returns:
+        dict: Column name -> list of values. Columns are present even if no rows are returned
+    """
+    columns = None
+    for names, rows in iter_query_batches(connection_string, query, params, arraysize, key_sets):
+        if columns is None:
+            columns = {name: [] for name in names}
+        for values, column_values in zip(zip(*rows), columns.values()):
+            column_values.extend(values)
+    return columns or {}
+
+
+def get_frame_from_query(connection_string: str, query: str, params: list | None = None, arraysize: int = config.DB_FETCH_ARRAYSIZE, key_sets: dict | None = None):
+    """Executes given sql query and returns the result as a DataFrame built directly from column arrays"""
+    columns = get_columns_from_query(connection_string, query, params, arraysize, key_sets)
+    return pd.DataFrame(columns)
+
+
+def fetch_concurrently(**loaders):
+    """
+    Run independent data lookups at the same time, so the wait is the slowest lookup instead of the sum.
+    Each lookup uses its own pooled connection. If a lookup fails, its exception is raised once all lookups have finished.
+
+    Args:
+        loaders: Functions without arguments, e.g. functools.partial(lis_enheder, connection_string=...), keyed by name
+
+    Returns:
+        dict: The result of each lookup, keyed by name
+    """
+    if len(loaders) <= 1:
+        return {name: loader() for name, loader in loaders.items()}
+
+    with ThreadPoolExecutor(max_workers=min(len(loaders), config.DB_MAX_CONCURRENT_QUERIES)) as executor:
+        futures = {name: executor.submit(loader) for name, loader in loaders.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def enrich(rows: list[dict], right: pd.DataFrame, left_on: str, right_on: str | None = None, *, how: str = "inner", numeric: bool = True):
+    """
+    Join finding rows with a reference frame, like pd.merge followed by to_dict("records").
+
+    With `numeric`, keys are compared as ints where possible, so e.g. LOSID 100, 100.0, Decimal(100) and "100" match,
+    and the key of the joined rows is the int, as after astype(int). Otherwise keys must be equal, e.g. for SDafdID.
+    Overlapping column names get the pandas suffixes "_x" and "_y".
+    The reference frame is indexed on its key and only the matched rows are converted,
+    so the cost grows with the number of rows and not with the size of the reference frame.
+
+    Args:
+        rows: Finding rows as dicts
+        right: Reference frame
+        left_on: Key in the finding rows
+        right_on: Key in the reference frame. Defaults to `left_on`
+        how: "inner" or "left"
+        numeric: Compare the keys as numeric ids
+
+    Returns:
+        list[dict]: The joined rows, in the order of `rows`
+    """
+    right_on = right_on or left_on
+    join_key = _join_key if numeric else _missing_as_none
+    if numeric:
+        rows = [{**row, left_on: _join_key(row.get(left_on))} if row.get(left_on) is not None else row for row in rows]
+
+    index = {}
+    for position, key in enumerate(right[right_on].tolist()):
+        key = join_key(key)
+        if key is not None:
+            index.setdefault(key, []).append(position)
+
+    matches = [index.get(join_key(row.get(left_on)), []) for row in rows]
+    positions = sorted({position for match in matches for position in match})
+    right_records = dict(zip(positions, right.iloc[positions].to_dict("records")))
+
+    left_columns = list(dict.fromkeys(column for row in rows for column in row))
+    right_columns = [column for column in right.columns if not (column == right_on and left_on == right_on)]
+    overlap = set(left_columns) & set(right_columns)
+
+    def left_part(row):
+        return {f"{column}_x" if column in overlap else column: row.get(column) for column in left_columns}
+
+    def right_part(record):
+        return {f"{column}_y" if column in overlap else column: record.get(column) for column in right_columns}
+
+    result = []
+    for row, match in zip(rows, matches):
+        if match:
+            result.extend({**left_part(row), **right_part(right_records[position])} for position in match)
+        elif how == "left":
+            result.append({**left_part(row), **{column: None for column in right_part({})}})
+    return result
+
+
+def _missing_as_none(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+def _join_key(value):
+    """Normalize a join key, so numeric ids match regardless of type. Missing keys are None"""
+    value = _missing_as_none(value)
+    if value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)) and value == int(value):
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    return value
@@ -0,0 +1,73 @@
+"""Module for remembering the open ServiceNow incident of each process between robot runs"""
+
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from robot_framework import config
+
+
+class IncidentCache:
+    """
+    Keeps the sys_id of the open ServiceNow incident per process name in a local SQLite file,
+    so an incident can be looked up by key instead of by searching the incident descriptions.
+
+    The cache is only a hint. The caller checks that the incident is still open, and forgets it otherwise.
+    """
+
+    def __init__(self, path: str = config.INCIDENT_CACHE_PATH):
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0, "stale": 0}
+
+    def get(self, process_name: str):
+        """The cached sys_id of the process, or None"""
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT sys_id FROM incidents WHERE process_name = ?", (process_name,)).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Incident cache error, searching ServiceNow: {str(e)}")
+            row = None
+
+        self.stats["hits" if row else "misses"] += 1
+        return row[0] if row else None
+
+    def put(self, process_name: str, sys_id: str):
+        """Remember the open incident of the process"""
+        try:
+            with closing(self._connect()) as conn:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO incidents (process_name, sys_id, updated) VALUES (?, ?, ?)",
+                        (process_name, sys_id, time.time())
+                    )
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not save incident {sys_id} in the incident cache: {str(e)}")
+
+    def forget(self, process_name: str):
+        """Forget the incident of the process, e.g. because it has been resolved"""
+        self.stats["stale"] += 1
+        try:
+            with closing(self._connect()) as conn:
+                with conn:
+                    conn.execute("DELETE FROM incidents WHERE process_name = ?", (process_name,))
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not remove incident from the incident cache: {str(e)}")
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return f"Incident cache: {stats['hits']} hits ({stats['stale']} no longer open), {stats['misses']} misses"
+
+    def _connect(self):
+        if not os.path.isabs(self.path):
+            # TEMP_PATH is a Windows path. Elsewhere it would create the cache inside the working directory
+            raise OSError(f"Incident cache path {self.path} is not absolute on this host")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS incidents (process_name TEXT PRIMARY KEY, sys_id TEXT, updated REAL)")
+        return conn
+
+
+# Shared by all robot runs on this machine
+incident_cache = IncidentCache()
@@ -0,0 +1,170 @@
+"""Module for keeping a local copy of a large query result and refreshing only the rows that changed"""
+
+import glob
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from robot_framework import config
+
+
+class IncrementalStore:
+    """
+    Keeps query results in local SQLite files with a checksum per key, e.g. per AnsættelsesID.
+
+    On each run the caller fetches the current checksums from the server, which is cheap compared to the
+    full result. Rows with a new or changed checksum are fetched again, rows whose key is gone are dropped,
+    and the other rows are reused. The result is fully reloaded when it is older than `full_refresh_seconds`,
+    so rows missed by a checksum collision do not stay stale.
+
+    Each result is stored per source, in a file named by a hash of the source, e.g. the connection string,
+    so results of different databases are kept apart and the connection string is not written to disk.
+    Files not used for `full_refresh_seconds` are deleted. Callers store only the columns they need, without names.
+    """
+
+    def __init__(self, directory: str = config.INCREMENTAL_DIR, full_refresh_seconds: float = config.INCREMENTAL_FULL_REFRESH_SECONDS):
+        self.directory = directory
+        self.full_refresh_seconds = full_refresh_seconds
+        self.stats = {"full": 0, "incremental": 0, "unchanged": 0, "changed": 0, "removed": 0}
+
+    def refresh(self, name: str, *, source: str, key_column: str, checksums: pd.DataFrame, fetch_all, fetch_keys):
+        """
+        Get the current result, fetching only the rows that changed since the last run.
+
+        Args:
+            name: Name of the stored result
+            source: Where the result is fetched from, e.g. the connection string. Only its hash is stored
+            key_column: Column identifying the rows. Must be present in `checksums` and in the fetched rows
+            checksums: The current checksum of each key, with `key_column` and a "checksum" column
+            fetch_all: Function fetching the whole result
+            fetch_keys: Function fetching the rows of the given keys
+
+        Returns:
+            pd.DataFrame: The current result
+        """
+        path = os.path.join(self.directory, f"{name}_{hashlib.sha256(source.encode()).hexdigest()[:16]}.sqlite")
+        self._remove_expired(path)
+        current = dict(zip(checksums[key_column].tolist(), checksums["checksum"].tolist()))
+
+        stored = self._load(path)
+        if stored is None or time.time() - stored["loaded_at"] > self.full_refresh_seconds:
+            frame = fetch_all()
+            self.stats["full"] += 1
+            self._save(path, {"frame": frame, "checksums": current, "loaded_at": time.time()})
+            return frame
+
+        changed = [key for key, checksum in current.items() if stored["checksums"].get(key) != checksum]
+        removed = stored["checksums"].keys() - current.keys()
+
+        frame = stored["frame"]
+        frame = frame[~frame[key_column].isin(set(changed) | removed)]
+        fetched = fetch_keys(changed) if changed else None
+        if fetched is not None and len(fetched):
+            # An empty frame would turn int columns into floats
+            frame = pd.concat([frame, fetched], ignore_index=True)
+
+        self.stats["incremental"] += 1
+        self.stats["unchanged"] += len(current) - len(changed)
+        self.stats["changed"] += len(changed)
+        self.stats["removed"] += len(removed)
+        self._save(path, {"frame": frame, "checksums": current, "loaded_at": stored["loaded_at"]})
+        return frame.reset_index(drop=True)
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return (
+            f"Incremental: {stats['full']} full loads, {stats['incremental']} incremental loads "
+            f"({stats['changed']} changed, {stats['removed']} removed, {stats['unchanged']} unchanged rows)"
+        )
+
+    def _load(self, path: str):
+        if not os.path.exists(path):
+            return None
+        try:
+            with closing(sqlite3.connect(path)) as conn:
+                loaded_at = conn.execute("SELECT loaded_at FROM state").fetchone()[0]
+                stored_checksums = dict(conn.execute("SELECT key, checksum FROM checksums"))
+                date_columns = [row[0] for row in conn.execute("SELECT name FROM date_columns")]
+                frame = pd.read_sql("SELECT * FROM rows", conn)
+        except (sqlite3.Error, OSError, TypeError, pd.errors.DatabaseError) as e:
+            print(f"Could not read incremental state {path}, loading everything: {str(e)}")
+            return None
+
+        for column in date_columns:
+            frame[column] = frame[column].map(_from_storable_date)
+        return {"frame": frame, "checksums": stored_checksums, "loaded_at": loaded_at}
+
+    def _save(self, path: str, state: dict):
+        frame = state["frame"]
+        columns = list(frame.columns)
+        date_columns = [column for column in columns if frame[column].map(lambda value: isinstance(value, date)).any()]
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first, so a stopped run doesn't leave a partial state
+            if os.path.exists(f"{path}.tmp"):
+                os.remove(f"{path}.tmp")
+            with closing(sqlite3.connect(f"{path}.tmp")) as conn:
+                with conn:
+                    # Columns without a declared type keep the type of each value, e.g. ints in text columns
+                    conn.execute(f"CREATE TABLE rows ({', '.join(_quote(column) for column in columns)})")
+                    conn.executemany(
+                        f"INSERT INTO rows VALUES ({', '.join('?' * len(columns))})",
+                        ([_to_storable(value) for value in row] for row in frame.itertuples(index=False, name=None))
+                    )
+                    conn.execute("CREATE TABLE date_columns (name)")
+                    conn.executemany("INSERT INTO date_columns VALUES (?)", [(column,) for column in date_columns])
+                    conn.execute("CREATE TABLE checksums (key PRIMARY KEY, checksum)")
+                    conn.executemany(
+                        "INSERT INTO checksums VALUES (?, ?)",
+                        ((_to_storable(key), _to_storable(checksum)) for key, checksum in state["checksums"].items())
+                    )
+                    conn.execute("CREATE TABLE state (loaded_at REAL)")
+                    conn.execute("INSERT INTO state VALUES (?)", (state["loaded_at"],))
+            os.replace(f"{path}.tmp", path)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Could not save incremental state {path}: {str(e)}")
+
+    def _remove_expired(self, path: str):
+        """Delete state files not used for `full_refresh_seconds`, e.g. of an old connection string"""
+        for other in glob.glob(os.path.join(self.directory, "*.sqlite")):
+            try:
+                if other != path and time.time() - os.path.getmtime(other) > self.full_refresh_seconds:
+                    os.remove(other)
+            except OSError as e:
+                print(f"Could not remove expired incremental state {other}: {str(e)}")
+
+
+def _quote(column: str):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _to_storable(value):
+    """SQLite can't store Decimal, numpy scalars or dates, which the fetched rows may hold"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if value is pd.NaT:
+        return None
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _from_storable_date(value):
+    """Dates are stored as ISO strings, with a time if they were datetimes"""
+    if not isinstance(value, str):
+        return value
+    return date.fromisoformat(value) if len(value) == 10 else datetime.fromisoformat(value)
+
+
+# Shared by all incremental lookups in the robot run
+incremental_store = IncrementalStore()
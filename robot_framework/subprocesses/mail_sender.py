@@ -0,0 +1,138 @@
+"""Module for sending e-mails over one SMTP session that is kept open for the whole robot run"""
+
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework.subprocesses.orchestrator_cache import orchestrator_cache
+
+
+class MailSender:
+    """
+    Sends e-mails through persistent SMTP sessions.
+
+    The sender address, SMTP server and port are read from OpenOrchestrator constants through the orchestrator cache.
+    A session is opened on the first send and kept for the next. Concurrent senders each get their own session.
+    A session idle for `health_check_interval` seconds is checked with NOOP before reuse.
+    If the server has dropped it during a send before the message was handed over with DATA,
+    it is reopened and the message is resent. Once DATA has been sent the server may have accepted the message,
+    so it is not resent, to avoid sending it twice.
+    """
+
+    def __init__(self, health_check_interval: float = config.SMTP_HEALTH_CHECK_INTERVAL, send_attempts: int = config.SMTP_SEND_ATTEMPTS):
+        self.health_check_interval = health_check_interval
+        self.send_attempts = send_attempts
+        self._idle: list[tuple[_SMTP, float]] = []
+        self._lock = threading.Lock()
+        self.stats = {"sent": 0, "connects": 0, "reconnects": 0}
+
+    def send(self, orchestrator_connection: OrchestratorConnection, receiver: str | list[str], subject: str, body: str, html_body: bool = True):
+        """Send an e-mail. Same message format as itk_dev_shared_components.smtp.smtp_util.send_email"""
+        settings = self._load_settings(orchestrator_connection)
+
+        msg = EmailMessage()
+        msg['to'] = receiver
+        msg['from'] = settings["sender"]
+        msg['subject'] = subject
+
+        if html_body:
+            msg.set_content("Please enable HTML to view this message.")
+            msg.add_alternative(body, subtype='html')
+        else:
+            msg.set_content(body)
+
+        smtp = self._checkout(settings)
+        try:
+            for attempt in range(1, self.send_attempts + 1):
+                smtp.data_started = False
+                try:
+                    smtp.send_message(msg)
+                    break
+                except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError) as e:
+                    # The session is broken. Open a new one and try again, unless the message may have been delivered
+                    data_started = smtp.data_started
+                    _quit(smtp)
+                    smtp = None
+                    if data_started or attempt == self.send_attempts:
+                        raise e
+                    self._count("reconnects")
+                    smtp = self._connect(settings)
+        finally:
+            if smtp is not None:
+                with self._lock:
+                    self._idle.append((smtp, time.monotonic()))
+        self._count("sent")
+
+    def close(self):
+        """Close the idle SMTP sessions"""
+        with self._lock:
+            idle = [smtp for smtp, _ in self._idle]
+            self._idle.clear()
+        for smtp in idle:
+            _quit(smtp)
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return f"SMTP: {stats['sent']} e-mails sent, {stats['connects']} connects, {stats['reconnects']} reconnects"
+
+    def _load_settings(self, orchestrator_connection: OrchestratorConnection):
+        return {
+            "sender": orchestrator_cache.get_constant(orchestrator_connection, "e-mail_noreply").value,
+            "server": orchestrator_cache.get_constant(orchestrator_connection, "smtp_server").value,
+            "port": orchestrator_cache.get_constant(orchestrator_connection, "smtp_port").value,
+        }
+
+    def _checkout(self, settings: dict):
+        """Take an idle session, or open a new one. Sessions are used by one sender at a time,
+        so concurrent workers each get their own session"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                smtp, last_used = self._idle.pop()
+
+            if time.monotonic() - last_used <= self.health_check_interval:
+                return smtp
+            try:
+                smtp.noop()
+                return smtp
+            except (smtplib.SMTPException, OSError):
+                _quit(smtp)
+                self._count("reconnects")
+
+        return self._connect(settings)
+
+    def _connect(self, settings: dict):
+        smtp = _SMTP(settings["server"], settings["port"])
+        smtp.starttls()
+        self._count("connects")
+        return smtp
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+
+class _SMTP(smtplib.SMTP):
+    """SMTP session that records whether the DATA command of the current message has been sent"""
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+def _quit(smtp: smtplib.SMTP):
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        pass
+
+
+# Shared by all e-mails sent in the robot run. Closed in reset.close_all
+mail_sender = MailSender()
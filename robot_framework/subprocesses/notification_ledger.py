@@ -0,0 +1,176 @@
+"""Module for a local ledger of notified findings, so unfixed errors are not notified again on every trigger run"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+from robot_framework import config
+from robot_framework.subprocesses.helper_functions import format_item
+
+# Fields identifying a finding, per process. Other fields, e.g. names, may change without it being a new finding
+FINDING_KEY_FIELDS = {
+    "KV1": ["Tjenestenummer", "Afdeling", "Institutionskode", "Overenskomst"],
+    "KV2": ["Tjenestenummer", "Afdeling", "Tillægsnummer"],
+    "KV3": ["Tjenestenummer", "Afdeling", "Overenskomst"],
+    "KV3-DEV": ["Tjenestenummer", "Afdeling", "Overenskomst"],
+    "KV4": ["Tjenestenummer", "Afdeling", "Overenskomst"],
+}
+
+
+class NotificationLedger:
+    """
+    Keeps a hash of each notified finding in a local SQLite file.
+
+    Findings are recorded as found when they are queued, and as notified once their notification has been sent
+    (see `confirm`), so a finding whose notification failed is notified on the next run. A finding is queued
+    once per run, even if it is found twice.
+
+    A finding notified within `suppression_seconds` is not notified again. After the window it is notified
+    again, and from the `escalate_after`'th notification it is marked with "Rykker" (the number of earlier
+    notifications), so the receiver can see that it is a reminder. A finding that has not been found for
+    `resolved_seconds` is considered fixed, and is notified as new if it reappears.
+    """
+
+    def __init__(self, path: str = config.NOTIFICATION_LEDGER_PATH, suppression_seconds: float = config.NOTIFICATION_SUPPRESSION_SECONDS,
+                 escalate_after: int = config.NOTIFICATION_ESCALATE_AFTER, resolved_seconds: float = config.NOTIFICATION_RESOLVED_SECONDS):
+        self.path = path
+        self.suppression_seconds = suppression_seconds
+        self.escalate_after = escalate_after
+        self.resolved_seconds = resolved_seconds
+        self._queued: set[str] = set()
+        self.stats = {"notified": 0, "suppressed": 0, "reminders": 0}
+
+    def filter(self, process: str, items: list | None, receiver_field: str | None = None, receiver: str | None = None):
+        """
+        Remove findings notified within the suppression window or already queued in this run,
+        and record the rest as found. They are recorded as notified by `confirm`.
+
+        Args:
+            process: The process of the findings, e.g. "KV1"
+            items: The findings
+            receiver_field: Field holding the receiver of each finding, e.g. "AF_email"
+            receiver: The receiver, if the findings are not sent to the receiver in `receiver_field`
+
+        Returns:
+            tuple: (items to notify, number of suppressed findings)
+        """
+        if not items:
+            return items, 0
+
+        now = time.time()
+        keys = [
+            finding_hash(process, item, item.get(receiver_field) if receiver_field else receiver)
+            for item in items
+        ]
+
+        try:
+            with closing(self._connect()) as conn:
+                with conn:
+                    notify = self._record(conn, process, keys, items, now)
+                    conn.execute("DELETE FROM findings WHERE last_seen < ?", (now - config.NOTIFICATION_LEDGER_RETENTION,))
+
+        except (sqlite3.Error, OSError) as e:
+            print(f"Notification ledger error, notifying all findings: {str(e)}")
+            return items, 0
+
+        self.stats["suppressed"] += len(items) - len(notify)
+        return notify or None, len(items) - len(notify)
+
+    def confirm(self, findings_per_process: dict, receiver: str | None):
+        """
+        Record findings as notified, once their notification has been sent.
+
+        Args:
+            findings_per_process: The notified findings keyed by process, e.g. {"KV1": [...]}
+            receiver: The receiver the findings were sent to
+        """
+        now = time.time()
+        rows = [
+            (finding_hash(process, finding, receiver), process, now, now)
+            for process, findings in findings_per_process.items()
+            for finding in findings
+        ]
+        try:
+            with closing(self._connect()) as conn:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO findings (hash, process, last_notified, last_seen, count) VALUES (?, ?, ?, ?, 1) "
+                        + "ON CONFLICT (hash) DO UPDATE SET last_notified = excluded.last_notified, last_seen = excluded.last_seen, count = count + 1",
+                        rows
+                    )
+        except (sqlite3.Error, OSError) as e:
+            # The notification is sent, so it must not fail on the ledger. The findings are notified again on the next run
+            print(f"Could not record {len(rows)} notified findings in the notification ledger: {str(e)}")
+            return
+        self.stats["notified"] += len(rows)
+
+    def _record(self, conn: sqlite3.Connection, process: str, keys: list, items: list, now: float):
+        """Record the findings and return the ones to notify"""
+        known = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            known.update(
+                (row[0], row[1:]) for row in conn.execute(
+                    f"SELECT hash, last_notified, last_seen, count FROM findings WHERE hash IN ({', '.join('?' * len(chunk))})", chunk
+                )
+            )
+
+        notify = []
+        for key, item in zip(keys, items):
+            if key in self._queued:
+                # Found twice in this run
+                continue
+
+            last_notified, last_seen, count = known.get(key, (None, None, 0))
+            if last_seen is not None and now - last_seen > self.resolved_seconds:
+                # Fixed and reintroduced since the last notification
+                last_notified, count = None, 0
+
+            if last_notified is not None and now - last_notified < self.suppression_seconds:
+                conn.execute("UPDATE findings SET last_seen = ? WHERE hash = ?", (now, key))
+                continue
+
+            if count + 1 >= self.escalate_after:
+                item = {**item, "Rykker": count}
+                self.stats["reminders"] += 1
+            notify.append(item)
+            self._queued.add(key)
+            conn.execute(
+                "INSERT OR REPLACE INTO findings (hash, process, last_notified, last_seen, count) VALUES (?, ?, ?, ?, ?)",
+                (key, process, last_notified, now, count)
+            )
+        return notify
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return f"Notification ledger: {stats['notified']} findings notified ({stats['reminders']} reminders), {stats['suppressed']} suppressed"
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS findings (hash TEXT PRIMARY KEY, process TEXT, last_notified REAL, last_seen REAL, count INTEGER)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS findings_last_seen ON findings (last_seen)")
+        return conn
+
+
+def finding_key(process: str, item: dict):
+    """The values identifying a finding"""
+    item = format_item(item)
+    return [process] + [str(item.get(field)) for field in FINDING_KEY_FIELDS[process]]
+
+
+def finding_hash(process: str, item: dict, receiver: str | None):
+    """Hash of the fields identifying a finding and its receiver"""
+    identity = [finding_key(process, item), receiver]
+    return hashlib.sha256(json.dumps(identity, ensure_ascii=False).encode()).hexdigest()
+
+
+# Shared by all trigger runs on this machine
+notification_ledger = NotificationLedger()
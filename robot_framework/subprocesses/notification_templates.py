@@ -0,0 +1,245 @@
+"""Module for the notification texts of each process, compiled once when the robot starts"""
+
+from string import Template
+from typing import Callable, NamedTuple
+
+from robot_framework.subprocesses.digest import DIGEST_FIELDS, digest_findings
+from robot_framework.worker_data.kv2_data import tillaeg_index
+
+KV1_INSTRUCTION_LINK = "https://intranet.aarhuskommune.dk/documents/146889"
+KV4_INSTRUCTION_LINK = "https://aarhuskommune.sharepoint.com/sites/IntranetDocumentSite/Intranetdokumentbibliotek/Forms/Seneste%20dokumenter.aspx?id=%2Fsites%2FIntranetDocumentSite%2FIntranetdokumentbibliotek%2FL%C3%A5st%20p%C3%A5%20grundl%C3%B8nstrin%2Epdf&parent=%2Fsites%2FIntranetDocumentSite%2FIntranetdokumentbibliotek&p=true&ga=1"
+
+# Placeholders available in all templates, and the field of the finding they are read from
+FINDING_FIELDS = {
+    "person_id": "Tjenestenummer",
+    "person_name": "Navn",
+    "overenskomst": "Overenskomst",
+    "afdeling": "Afdeling",
+    "sd_inst_kode": "Institutionskode",
+    "enhedsnavn": "Enhedsnavn",
+    "afdtype_txt": "afdtype_txt",
+}
+
+# Column headers in the digest tables
+DIGEST_HEADERS = {
+    "Institutionskode": "SD institutionskode",
+    "afdtype_txt": "Afdelingstype",
+    "Tillægsnavn": "Fundet tillæg",
+    "Rykker": "Tidligere notifikationer",
+}
+
+
+class NotificationTemplate(NamedTuple):
+    """The texts of a process. `body` renders a single finding, `digest_introduction` precedes the table in a digest"""
+    subject: str
+    body: Template
+    digest_introduction: str
+    # Placeholders computed from the finding, in addition to FINDING_FIELDS
+    extra_fields: Callable[[dict], dict] | None = None
+
+
+def find_missing_tillaeg(found_number: int):
+    """Find the partner of a tillægsnummer in the predefined pairs. Returns (number, name, A/B type), or Nones if not found"""
+    partner = tillaeg_index.get(found_number)
+    if partner is None:
+        return None, None, None
+    return partner.number, partner.name, partner.type
+
+
+def _kv2_fields(finding: dict):
+    found_number = int(finding["Tillægsnummer"])
+    match_number, match_name, match_type = find_missing_tillaeg(found_number)
+    return {
+        "found_number": found_number,
+        "found_name": finding["Tillægsnavn"],
+        "found_type": tillaeg_index[found_number].own_type if found_number in tillaeg_index else None,
+        "match_number": match_number,
+        "match_name": match_name,
+        "match_type": match_type,
+    }
+
+
+TEMPLATES = {
+    # Inspirationsansættelser
+    "KV1": NotificationTemplate(
+        subject="Inspirationsansættelse på XA institution",
+        body=Template(
+            "<p>Der er ved en fejl blevet oprettet en inspirationsansættelse på en XA enhed i jeres Administrative Fællesskab. <br>"
+            + "Inspirationsansættelser skal udelukkende oprettes på XC enheder. <br>"
+            + "Du skal derfor slette ansættelsen på XA enheden og oprette ansættelsen på ny på den korrekte XC enhed"
+            + "- se nedenstående.</p>"
+            + "-" * 100
+            + "<h4>Følgende inspirationsansættelse er registreret på en XA SD-institutionskode:</h4>"
+            + "<p>Tjenestenummer: $person_id</p>"
+            + "<p>Afdeling: $afdeling</p>"
+            + "<p>SD institutionskode: $sd_inst_kode</p>"
+            + "<p>Registreret overenskomst: $overenskomst</p>"
+            + f'<p>Du kan finde vejledningen til "Inspirationsansættelser" på <a href={KV1_INSTRUCTION_LINK}>dette link</a> (AARHUSINTRA)</p>'
+            + "-" * 100
+        ),
+        digest_introduction=(
+            "<h4>Følgende inspirationsansættelser er registreret på en XA SD-institutionskode:</h4>"
+            + "<p>Inspirationsansættelser skal udelukkende oprettes på XC enheder. "
+            + "Du skal derfor slette ansættelserne på XA enhederne og oprette dem på ny på de korrekte XC enheder. "
+            + f'Du kan finde vejledningen til "Inspirationsansættelser" på <a href={KV1_INSTRUCTION_LINK}>dette link</a> (AARHUSINTRA)</p>'
+        ),
+    ),
+    # Manglende tillægsnummer
+    "KV2": NotificationTemplate(
+        subject="Manglende tillægsnummer i ansættelse",
+        body=Template(
+            "<h4>Følgende ansættelse mangler et tillægsnummer, "
+            + "da denne er registreret med et $found_type-tillægsnummer, men mangler et $match_type-tillægsnummer:</h4>"
+            + "<p>Tjenestenummer: $person_id</p>"
+            + "<p>Navn: $person_name</p>"
+            + "<p>Overenskomst: $overenskomst</p>"
+            + "<p>Afdeling: $afdeling ($enhedsnavn)</p>"
+            + "<p>SD institutionskode: $sd_inst_kode</p>"
+            + "<p>Fundet tillæg: $found_number-$found_name</p>"
+            + "<p>Manglende tillæg: $match_number-$match_name</p>"
+            + "Ved rettelse af denne fejl skal lønsammensætningen kontrolleres. Ved spørgsmål, kontakt da Personale."
+        ),
+        digest_introduction=(
+            "<h4>Følgende ansættelser mangler et tillægsnummer, da de kun er registreret med det ene tillæg af et A/B-par:</h4>"
+            + "<p>Ved rettelse af disse fejl skal lønsammensætningen kontrolleres. Ved spørgsmål, kontakt da Personale.</p>"
+        ),
+        extra_fields=_kv2_fields,
+    ),
+    # Forkert overenskomst skole/dagtilbud
+    "KV3": NotificationTemplate(
+        subject="Fejl i SD-overenskomst",
+        body=Template(
+            "<h4>Følgende ansættelse er oprettet med en forkert SD overenskomst:</h4>"
+            + "<p>Tjenestenummer: $person_id</p>"
+            + "<p>Navn: $person_name</p>"
+            + "<p>Afdeling: $afdeling ($enhedsnavn)</p>"
+            + "<p>Afdelingstype: $afdtype_txt</p>"
+            + "<p>SD institutionskode: $sd_inst_kode</p>"
+            + "<p>Registreret overenskomst: $overenskomst</p>"
+        ),
+        digest_introduction="<h4>Følgende ansættelser er oprettet med en forkert SD overenskomst:</h4>",
+    ),
+    # Manglende låst anciennitetsdato
+    "KV4": NotificationTemplate(
+        subject="Manglende låst anciennitet på leder",
+        body=Template(
+            "<h4>Følgende leder har ikke fået fastlåst sin anciennitetsdato til dato 31.12.9999:</h4>"
+            + "<p>Tjenestenummer: $person_id</p>"
+            + "<p>Navn: $person_name</p>"
+            + "<p>Afdeling: $afdeling</p>"
+            + "<p>SD institutionskode: $sd_inst_kode</p>"
+            + "<p>Registreret overenskomst: $overenskomst</p>"
+            + f"<p>Du kan finde vejledningen <a href={KV4_INSTRUCTION_LINK}>her</a>"
+            + "<p>Bliver datoen ikke rettet til 31.12.9999, vil lederens grundlønstrin stige med et løntrin hvert år. <br>"
+            + "OBS hvis der er tilknyttet et grundlønstillæg til stillingen skal du huske at oprette dette manuelt (måske er tillægget allerede oprettet, se lønsammensætning)."
+        ),
+        digest_introduction=(
+            "<h4>Følgende ledere har ikke fået fastlåst deres anciennitetsdato til dato 31.12.9999:</h4>"
+            + "<p>Bliver datoen ikke rettet til 31.12.9999, vil lederens grundlønstrin stige med et løntrin hvert år. <br>"
+            + "OBS hvis der er tilknyttet et grundlønstillæg til stillingen skal du huske at oprette dette manuelt.</p>"
+        ),
+    ),
+}
+TEMPLATES["KV3-DEV"] = TEMPLATES["KV3"]
+
+
+def _check_templates():
+    """Fail at startup, not at the first e-mail, if a template uses an unknown placeholder or '$' wrongly"""
+    for process_type, template in TEMPLATES.items():
+        if not template.body.is_valid():
+            raise ValueError(f"Invalid placeholder in the template of {process_type}")
+        unknown = set(template.body.get_identifiers()) - set(FINDING_FIELDS)
+        if template.extra_fields is None and unknown:
+            raise ValueError(f"Unknown placeholders in the template of {process_type}: {unknown}")
+
+
+_check_templates()
+
+
+def get_template(process_type: str):
+    """The template of a process"""
+    template = TEMPLATES.get(process_type)
+    if template is None:
+        raise ValueError(f"No notification template for process {process_type}")
+    return template
+
+
+def render(process_type: str, payload: dict):
+    """
+    Render the text and subject of a queue element from its parsed data, a single finding or a digest.
+
+    Returns:
+        tuple: (text, subject)
+    """
+    if "rows" in payload:
+        text, subject = render_digest(payload)
+    else:
+        text, subject = render_finding(process_type, payload)
+
+    # Findings notified before without being fixed (see notification_ledger)
+    if "rows" in payload and "Rykker" in payload["columns"]:
+        text = (
+            "<p><b>Påmindelse: Nogle af fejlene er tidligere notificeret og endnu ikke rettet. "
+            + "Se kolonnen \"Tidligere notifikationer\".</b></p>"
+            + text
+        )
+        subject = f"Påmindelse: {subject}"
+    elif payload.get("Rykker"):
+        text = f"<p><b>Påmindelse: Fejlen er tidligere notificeret {payload['Rykker']} gange og er endnu ikke rettet.</b></p>" + text
+        subject = f"Påmindelse: {subject}"
+
+    return text, subject
+
+
+def render_many(process_type: str, payloads: list[dict]):
+    """Render several payloads of a process in one call, e.g. the findings of a digest. Returns a list of (text, subject)"""
+    return [render(process_type, payload) for payload in payloads]
+
+
+def render_finding(process_type: str, finding: dict):
+    """Render the text and subject for a single finding"""
+    template = get_template(process_type)
+    values = {placeholder: finding.get(field) for placeholder, field in FINDING_FIELDS.items()}
+    if template.extra_fields:
+        values.update(template.extra_fields(finding))
+    return template.body.substitute(values), template.subject
+
+
+def render_digest(payload: dict):
+    """Render one message with a table of findings per process for a digest queue element"""
+    findings_per_process = digest_findings(payload)
+    part, part_count = payload["part"]
+
+    sections = []
+    subjects = []
+    for process_type, findings in findings_per_process.items():
+        template = get_template(process_type)
+        subjects.append(template.subject)
+
+        columns = DIGEST_FIELDS[process_type] + (["Rykker"] if "Rykker" in findings[0] else [])
+        headers = [DIGEST_HEADERS.get(column, column) for column in columns]
+        if process_type == "KV2":
+            headers.append("Manglende tillæg")
+
+        rows = []
+        for finding in findings:
+            cells = [finding[column] for column in columns]
+            if process_type == "KV2":
+                match_number, match_name, _ = find_missing_tillaeg(int(finding["Tillægsnummer"]))
+                cells.append(f"{match_number}-{match_name}")
+            rows.append("<tr>" + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>")
+
+        sections.append(
+            template.digest_introduction
+            + "<table border='1' cellpadding='4' style='border-collapse: collapse'>"
+            + "<tr>" + "".join(f"<th>{header}</th>" for header in headers) + "</tr>"
+            + "".join(rows)
+            + "</table>"
+        )
+
+    text = "<br>".join(sections)
+    subject = subjects[0] if len(subjects) == 1 else "Fejl i ansættelser i SD Løn"
+    if part_count > 1:
+        subject = f"{subject} ({part}/{part_count})"
+
+    return text, subject
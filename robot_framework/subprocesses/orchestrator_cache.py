@@ -0,0 +1,63 @@
+"""Module for caching OpenOrchestrator constants and credentials during the robot run"""
+
+import threading
+import time
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+
+
+class OrchestratorCache:
+    """
+    Keeps constants and credentials read through the orchestrator connection, so each is fetched
+    from the Orchestrator database once per `ttl` seconds instead of on every use.
+
+    Credentials are only kept in memory and are never logged. Entries can be invalidated explicitly,
+    e.g. when a service rejects a credential that has been changed in Orchestrator.
+    """
+
+    def __init__(self, ttl: float = config.ORCHESTRATOR_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: dict[tuple[str, str], tuple[object, float]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get_constant(self, orchestrator_connection: OrchestratorConnection, name: str):
+        """The constant with the given name, as returned by OrchestratorConnection.get_constant"""
+        return self._get(("constant", name), lambda: orchestrator_connection.get_constant(name))
+
+    def get_credential(self, orchestrator_connection: OrchestratorConnection, name: str):
+        """The credential with the given name, as returned by OrchestratorConnection.get_credential"""
+        return self._get(("credential", name), lambda: orchestrator_connection.get_credential(name))
+
+    def invalidate(self, name: str | None = None):
+        """Drop the constant and credential with the given name, or everything if no name is given"""
+        with self._lock:
+            keys = [key for key in self._entries if name is None or key[1] == name]
+            for key in keys:
+                del self._entries[key]
+            self.stats["invalidations"] += len(keys)
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return f"Orchestrator cache: {stats['hits']} hits, {stats['misses']} misses, {stats['invalidations']} invalidations"
+
+    def _get(self, key: tuple[str, str], load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self.stats["hits"] += 1
+                return entry[0]
+
+        # Loaded outside the lock, so a slow lookup doesn't block the other workers
+        value = load()
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self.stats["misses"] += 1
+        return value
+
+
+# Shared by everything in the robot run that reads constants and credentials
+orchestrator_cache = OrchestratorCache()
@@ -0,0 +1,251 @@
+"""Module for claiming queue elements and setting their statuses in batches"""
+
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from OpenOrchestrator.database import db_util
+from OpenOrchestrator.database.queues import QueueElement, QueueStatus
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from robot_framework import config
+
+
+class QueueLeaser:  # pylint: disable=too-many-instance-attributes
+    """
+    Claims queue elements `lease_size` at a time and collects their final statuses, which are written
+    in one transaction when `batch_size` statuses are waiting or `checkpoint_interval` seconds have passed.
+
+    Leases and statuses are written to a local journal before they are sent to the database. If the robot
+    stops before a checkpoint, the next run replays the journal: collected statuses are written, and
+    leased elements without a status are set back to 'New', so they are processed again.
+
+    A leased element stays in the journal until its final status has been written. At the end of the run,
+    leased elements without a final status, whether handed out or not, are set back to 'New'.
+
+    The batched reads and writes use the database session of OpenOrchestrator (db_util._get_session),
+    which is not part of its public API. The OpenOrchestrator version is pinned in pyproject.toml for this reason.
+    If the session is not available, elements are claimed and updated one at a time through the orchestrator connection.
+    """
+
+    def __init__(self, lease_size: int = config.QUEUE_LEASE_SIZE, batch_size: int = config.QUEUE_STATUS_BATCH_SIZE,
+                 checkpoint_interval: float = config.QUEUE_CHECKPOINT_INTERVAL, journal_dir: str = config.QUEUE_JOURNAL_DIR):
+        self.lease_size = lease_size
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+        self.journal_dir = journal_dir
+        self._journal_path = os.path.join(journal_dir, f"queue_journal_{uuid.uuid4().hex}.jsonl")
+        self._leased: dict[str, list[QueueElement]] = {}
+        # Ids of leased elements without a final status
+        self._outstanding: set[str] = set()
+        self._statuses: list[dict] = []
+        self._last_checkpoint = time.monotonic()
+        self._batched = True
+        self._lock = threading.Lock()
+        self.stats = {"leases": 0, "leased": 0, "checkpoints": 0, "recovered": 0}
+
+    def next_element(self, orchestrator_connection: OrchestratorConnection, queue_name: str, limit: int | None = None):
+        """
+        Get the next element of the queue, from the leased elements or by leasing a new batch.
+
+        Args:
+            limit: The most elements the caller will take, so no more than that are leased
+
+        Returns:
+            QueueElement | None: The element, set to 'In Progress', or None if the queue is empty
+        """
+        with self._lock:
+            leased = self._leased.setdefault(queue_name, [])
+            if not leased and self._batched:
+                leased.extend(self._lease(queue_name, min(self.lease_size, limit or self.lease_size)))
+            if leased:
+                return leased.pop(0)
+
+        if not self._batched:
+            return orchestrator_connection.get_next_queue_element(queue_name)
+        return None
+
+    def set_status(self, orchestrator_connection: OrchestratorConnection, element_id, status: QueueStatus, message: str | None = None):
+        """Set the status of an element. 'Done' and 'Failed' are collected and written at the next checkpoint"""
+        if not self._batched or status not in (QueueStatus.DONE, QueueStatus.FAILED):
+            orchestrator_connection.set_queue_element_status(element_id, status, message)
+            return
+
+        entry = {"id": str(element_id), "status": status.name, "message": message, "time": datetime.now().isoformat()}
+        with self._lock:
+            self._journal({"status": entry})
+            self._statuses.append(entry)
+            self._outstanding.discard(entry["id"])
+            due = len(self._statuses) >= self.batch_size or time.monotonic() - self._last_checkpoint >= self.checkpoint_interval
+        if due:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Write the collected statuses to the database in one transaction"""
+        with self._lock:
+            statuses, self._statuses = self._statuses, []
+            self._last_checkpoint = time.monotonic()
+            if not statuses:
+                return
+            try:
+                _write_statuses(statuses)
+            except (SQLAlchemyError, RuntimeError) as e:
+                # Keep the statuses for the next checkpoint. They are also in the journal
+                self._statuses = statuses + self._statuses
+                print(f"Could not write queue statuses: {str(e)}")
+                return
+            self._journal({"written": [entry["id"] for entry in statuses]})
+            self.stats["checkpoints"] += 1
+
+    def release(self):
+        """
+        Write the collected statuses and set leased elements without a final status back to 'New'.
+        The journal is removed once nothing in it is left to write, otherwise the next run recovers it.
+        """
+        self.checkpoint()
+        with self._lock:
+            self._leased.clear()
+            unfinished = list(self._outstanding)
+            try:
+                if unfinished:
+                    _reset_elements(unfinished)
+                    self._journal({"reset": unfinished})
+                    self._outstanding.clear()
+                if not self._statuses and os.path.exists(self._journal_path):
+                    os.remove(self._journal_path)
+            except (SQLAlchemyError, RuntimeError, OSError) as e:
+                print(f"Could not release leased queue elements: {str(e)}")
+
+    def recover(self):
+        """
+        Replay journals left by runs that stopped before their last checkpoint.
+        A journal is only replayed when it has not been written to for QUEUE_LEASE_TIMEOUT seconds,
+        so the journals of robots running at the same time are left alone.
+        """
+        for path in glob.glob(os.path.join(self.journal_dir, "queue_journal_*.jsonl")):
+            if path == self._journal_path or time.time() - os.path.getmtime(path) < config.QUEUE_LEASE_TIMEOUT:
+                continue
+            try:
+                leased, statuses = _read_journal(path)
+                if statuses:
+                    _write_statuses(statuses)
+                unfinished = leased - {entry["id"] for entry in statuses}
+                if unfinished:
+                    _reset_elements(list(unfinished))
+                os.remove(path)
+                self.stats["recovered"] += len(leased)
+            except (SQLAlchemyError, RuntimeError, OSError, ValueError) as e:
+                print(f"Could not recover queue journal {path}: {str(e)}")
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return (
+            f"Queue leasing: {stats['leased']} elements in {stats['leases']} leases, "
+            f"{stats['checkpoints']} checkpoints, {stats['recovered']} recovered from earlier runs"
+        )
+
+    def _lease(self, queue_name: str, count: int):
+        """Claim up to `count` new elements and set them to 'In Progress' in one transaction.
+        Rows locked by other robots are skipped, so two robots never claim the same element"""
+        try:
+            with db_util._get_session() as session:  # pylint: disable=protected-access
+                elements = session.scalars(
+                    select(QueueElement)
+                    .where(QueueElement.queue_name == queue_name)
+                    .where(QueueElement.status == QueueStatus.NEW)
+                    .order_by(QueueElement.created_date)
+                    .limit(count)
+                    .with_for_update(skip_locked=True)
+                ).all()
+                now = datetime.now()
+                for element in elements:
+                    element.status = QueueStatus.IN_PROGRESS
+                    element.start_date = now
+                session.commit()
+                if elements:
+                    self._journal({"leased": [str(element.id) for element in elements]})
+                    self._outstanding.update(str(element.id) for element in elements)
+                for element in elements:
+                    session.refresh(element)
+                session.expunge_all()
+
+        except (SQLAlchemyError, RuntimeError, AttributeError) as e:
+            print(f"Batch leasing not available, claiming queue elements one at a time: {str(e)}")
+            self._batched = False
+            return []
+
+        self.stats["leases"] += 1
+        self.stats["leased"] += len(elements)
+        return list(elements)
+
+    def _journal(self, record: dict):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with open(self._journal_path, "a", encoding="utf-8") as journal:
+            journal.write(json.dumps(record) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+
+def _write_statuses(statuses: list[dict]):
+    """Write final statuses by primary key in one transaction. The message is only changed if one is given"""
+    rows = [
+        {
+            "id": uuid.UUID(entry["id"]),
+            "status": QueueStatus[entry["status"]],
+            "end_date": datetime.fromisoformat(entry["time"]),
+            **({"message": entry["message"][:1000]} if entry["message"] is not None else {}),
+        }
+        for entry in statuses
+    ]
+    with db_util._get_session() as session:  # pylint: disable=protected-access
+        for has_message in (True, False):
+            batch = [row for row in rows if ("message" in row) == has_message]
+            if batch:
+                session.execute(update(QueueElement), batch)
+        session.commit()
+
+
+def _reset_elements(element_ids: list):
+    """Set leased elements back to 'New', unless they have been finished in the meantime"""
+    ids = [uuid.UUID(str(element_id)) for element_id in element_ids]
+    with db_util._get_session() as session:  # pylint: disable=protected-access
+        session.execute(
+            update(QueueElement)
+            .where(QueueElement.id.in_(ids))
+            .where(QueueElement.status == QueueStatus.IN_PROGRESS)
+            .values(status=QueueStatus.NEW, start_date=None)
+        )
+        session.commit()
+
+
+def _read_journal(path: str):
+    """Leased element ids and the statuses that were not written, from a journal"""
+    leased = set()
+    statuses = {}
+    with open(path, encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be cut off if the robot stopped while writing it
+                continue
+            leased.update(record.get("leased", []))
+            if "status" in record:
+                statuses[record["status"]["id"]] = record["status"]
+            for element_id in record.get("written", []):
+                statuses.pop(element_id, None)
+                leased.discard(element_id)
+            for element_id in record.get("reset", []):
+                leased.discard(element_id)
+    return leased, list(statuses.values())
+
+
+# Shared by the queue loop in the robot run
+queue_leaser = QueueLeaser()
@@ -0,0 +1,176 @@
+"""Module for caching slowly changing reference data (LIS/SD/AF master data) during the robot run"""
+
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import pandas as pd
+
+from robot_framework import config
+from robot_framework.subprocesses.helper_functions import get_items_from_query
+from robot_framework.subprocesses.snapshot_store import snapshot_key, snapshot_store
+
+
+class ReferenceCache:
+    """
+    Keeps DataFrames returned by reference data lookups, keyed by function and arguments.
+
+    Entries expire after `ttl` seconds. When the cached frames exceed `max_bytes`,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, ttl: float = config.REFERENCE_CACHE_TTL, max_bytes: int = config.REFERENCE_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, tuple[pd.DataFrame, float, int]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._key_locks = defaultdict(threading.Lock)
+        self.stats = {"hits": 0, "narrowed": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: tuple):
+        """Get a cached frame, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            frame, loaded_at, size = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                del self._entries[key]
+                self._size -= size
+                return None
+            self._entries.move_to_end(key)
+            return frame
+
+    def put(self, key: tuple, frame: pd.DataFrame):
+        """Cache a frame and evict the least recently used entries if the memory cap is exceeded"""
+        size = int(frame.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._size -= old[2]
+            self._entries[key] = (frame, time.monotonic(), size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.stats["evictions"] += 1
+
+    def key_lock(self, key: tuple) -> threading.Lock:
+        """Lock held while loading `key`, so concurrent callers wait for one load instead of scanning twice"""
+        with self._lock:
+            return self._key_locks[key]
+
+    def count(self, stat: str):
+        """Increment a statistics counter"""
+        with self._lock:
+            self.stats[stat] += 1
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return (
+            f"Reference cache: {stats['hits']} hits, {stats['narrowed']} served from broader results, "
+            f"{stats['misses']} misses, {stats['evictions']} evictions, {self._size / 1e6:.1f} MB cached"
+        )
+
+
+# Shared by all reference data lookups in the robot run
+reference_cache = ReferenceCache()
+
+
+def cached_reference_data(subset_argument: str | None = None, subset_column: str | None = None, widen: bool = False,
+                          fingerprint_sql: str | None = None, connection_argument: str = "connection_string"):
+    """
+    Decorator caching a reference data lookup that returns a DataFrame.
+
+    If the lookup has a `subset_argument` that narrows the result to rows where `subset_column`
+    is in the given values, a narrow call is served by filtering a cached broad call (argument None).
+    The subset column is compared as numeric ids.
+
+    Args:
+        subset_argument: Name of the argument narrowing the result, if any
+        subset_column: Column in the result that `subset_argument` filters on
+        widen: Load the broad result on a narrow miss, so later calls with any subset are served from it
+        fingerprint_sql: Cheap query identifying the state of the source data. If given, results are also
+            kept in the local snapshot store and reused by later runs while the fingerprint is unchanged
+        connection_argument: Name of the argument holding the connection string, used for the fingerprint
+
+    Callers get a copy of the cached frame and are free to modify it.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def load(key: tuple, arguments: dict):
+            if not fingerprint_sql:
+                return func(**arguments)
+
+            fingerprints = []
+
+            def fingerprint():
+                if not fingerprints:
+                    rows = get_items_from_query(arguments[connection_argument], fingerprint_sql)
+                    fingerprints.append(repr([tuple(row.values()) for row in rows or []]))
+                return fingerprints[0]
+
+            store_key = snapshot_key(func.__qualname__, key)
+            frame = snapshot_store.load(store_key, fingerprint)
+            if frame is None:
+                fingerprint_value = fingerprint()
+                frame = func(**arguments)
+                snapshot_store.save(store_key, frame, fingerprint_value)
+            return frame
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {name: _hashable(value) for name, value in bound.arguments.items()}
+            key = (func.__qualname__, tuple(sorted(arguments.items())))
+
+            subset = arguments.get(subset_argument) if subset_argument else None
+            broad_key = None
+            if subset:
+                broad_key = (func.__qualname__, tuple(sorted({**arguments, subset_argument: None}.items())))
+
+            with reference_cache.key_lock(broad_key if subset and widen else key):
+                frame = reference_cache.get(key)
+                if frame is not None:
+                    reference_cache.count("hits")
+                    return frame.copy()
+
+                broad = reference_cache.get(broad_key) if broad_key else None
+                if broad is None and broad_key and widen:
+                    reference_cache.count("misses")
+                    broad = load(broad_key, {**bound.arguments, subset_argument: None})
+                    reference_cache.put(broad_key, broad)
+                elif broad is not None:
+                    reference_cache.count("narrowed")
+
+                if broad is not None:
+                    values = pd.to_numeric(pd.Series(subset), errors="coerce")
+                    return broad[pd.to_numeric(broad[subset_column], errors="coerce").isin(values)].copy()
+
+                reference_cache.count("misses")
+                frame = load(key, bound.arguments)
+                reference_cache.put(key, frame)
+                return frame.copy()
+
+        return wrapper
+    return decorator
+
+
+def _hashable(value):
+    if isinstance(value, (list, set)):
+        return tuple(value)
+    return value
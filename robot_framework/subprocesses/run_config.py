@@ -0,0 +1,116 @@
+"""Module for the process arguments of a robot run and the data of its queue elements, each parsed once"""
+
+import json
+from dataclasses import dataclass, fields
+
+from OpenOrchestrator.database.queues import QueueElement
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+
+@dataclass(frozen=True)
+class RunConfig:  # pylint: disable=too-many-instance-attributes
+    """The process arguments of the trigger, see the README"""
+    process: str
+    notification_type: str
+    # A receiver for all controls, or in ALL mode a receiver per control, e.g. {"KV1": "AF", "KV2": "x@aarhus.dk"}
+    notification_receiver: str | dict
+    incremental: bool = False
+    digest: bool = False
+    digest_by_kv: bool = True
+    suppress_repeats: bool = False
+
+    @classmethod
+    def from_json(cls, process_arguments: str):
+        """
+        Parse and validate the process arguments.
+        Raises ValueError if they are not a json object, or an argument is missing or has the wrong type.
+        """
+        try:
+            args = json.loads(process_arguments or "")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Process arguments are not valid json: {process_arguments}") from e
+        if not isinstance(args, dict):
+            raise ValueError(f"Process arguments must be a json object: {process_arguments}")
+
+        values = {}
+        for field in fields(cls):
+            if field.name not in args:
+                if field.type is not bool:
+                    raise ValueError(f"No {field.name} defined in process arguments: {args}")
+                continue
+            value = args[field.name]
+            if field.name == "notification_receiver":
+                value = _parse_receiver(value)
+            elif field.type is str and not (isinstance(value, str) and value.strip()):
+                raise ValueError(f"{field.name} in process arguments must be a non-empty string, got {value!r}")
+            if field.type is bool and not isinstance(value, bool):
+                raise ValueError(f"{field.name} in process arguments must be true or false, got {value!r}")
+            values[field.name] = value
+
+        values["process"] = values["process"].upper()
+        return cls(**values)
+
+    def receiver_for(self, process: str):
+        """The receiver of the notifications of a control. Raises ValueError if none is given for it"""
+        if isinstance(self.notification_receiver, str):
+            return self.notification_receiver
+        receiver = self.notification_receiver.get(process)
+        if receiver is None:
+            raise ValueError(f"No notification_receiver defined for {process} in process arguments")
+        return receiver
+
+    def af_receiver(self, process: str):
+        """Whether the notifications of a control are sent to the AF of each finding"""
+        return self.receiver_for(process).upper() == "AF"
+
+    def receiver_field(self, process: str):
+        """Field holding the receiver of each finding of a control, or None if all its findings go to the same receiver"""
+        return "AF_email" if self.af_receiver(process) else None
+
+
+def _parse_receiver(value):
+    """A receiver, or a receiver per control keyed by process"""
+    if isinstance(value, dict) and value:
+        receivers = {str(process).upper(): _parse_receiver(receiver) for process, receiver in value.items()}
+        if all(isinstance(receiver, str) for receiver in receivers.values()):
+            return receivers
+    elif isinstance(value, str) and value.strip():
+        return value
+    raise ValueError(f"notification_receiver in process arguments must be a non-empty string or an object of strings per control, got {value!r}")
+
+
+def get_run_config(orchestrator_connection: OrchestratorConnection) -> RunConfig:
+    """The run configuration, parsed from the process arguments on first use and kept on the connection"""
+    run_config = getattr(orchestrator_connection, "run_config", None)
+    if run_config is None:
+        run_config = RunConfig.from_json(orchestrator_connection.process_arguments)
+        orchestrator_connection.run_config = run_config
+    return run_config
+
+
+@dataclass(frozen=True)
+class QueuePayload:
+    """The decoded data of a queue element, a single finding or a digest of findings"""
+    data: dict
+
+    @classmethod
+    def from_element(cls, queue_element: QueueElement):
+        """Decode the data of a queue element"""
+        data = json.loads(queue_element.data)
+        if not isinstance(data, dict):
+            raise ValueError(f"Data of queue element {queue_element.id} is not a json object")
+        return cls(data)
+
+    @property
+    def is_digest(self):
+        """Whether the element is a digest, see digest.build_digests"""
+        return "rows" in self.data
+
+    def receiver(self, run_config: RunConfig, process: str):
+        """The receiver of the notification, the AF of the finding or the receiver in the process arguments"""
+        if not run_config.af_receiver(process):
+            return run_config.receiver_for(process)
+        receiver = self.data.get("AF_email")
+        if not receiver:
+            raise ValueError("No AF_email in queue element data")
+        return receiver
@@ -0,0 +1,230 @@
+"""Module for creating ServiceNow cases for findings, many per request"""
+
+import base64
+import html
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from robot_framework import config
+from robot_framework.servicenow_handler import service_now_client
+from robot_framework.subprocesses.notification_templates import render_many
+
+BATCH_PATH = "/api/now/v1/batch"
+
+# Prefix of the correlation_id of the cases created by the robot, e.g. "SDLON:KV2:12345"
+CORRELATION_PREFIX = "SDLON"
+
+
+class ServiceNowCaseSubmitter:
+    """
+    Creates a ServiceNow case per finding, unless an open case exists for the same Tjenestenummer and process.
+
+    The open cases are listed once per run and kept as a set of correlation ids, which is updated as cases
+    are created. New cases are sent `batch_size` at a time through the ServiceNow batch API. If the instance
+    doesn't allow the batch API, they are posted with up to SERVICE_NOW_MAX_CONCURRENT_REQUESTS requests
+    at the same time over the pooled session.
+    """
+
+    def __init__(self, table: str = config.SERVICE_NOW_CASE_TABLE, batch_size: int = config.SERVICE_NOW_CASE_BATCH_SIZE):
+        self.table = table
+        self.batch_size = batch_size
+        self._open_cases: set[str] | None = None
+        self._batch_available = True
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "duplicates": 0, "batches": 0, "failed": 0}
+
+    @property
+    def table_path(self):
+        """API path of the case table"""
+        return f"/api/now/table/{self.table}"
+
+    def submit(self, orchestrator_connection: OrchestratorConnection, findings: list[tuple[str, dict]], receiver: str | None = None):
+        """
+        Create cases for findings that don't have an open case.
+
+        Args:
+            findings: (process, finding) pairs, e.g. [("KV2", {...})]
+            receiver: E-mail added to the watch list of the cases
+
+        Returns:
+            tuple: (number of created cases, number of findings with an open case).
+            Raises RuntimeError if some cases could not be created. The others are created and not sent again
+        """
+        open_cases = self._get_open_cases(orchestrator_connection)
+
+        new_findings = {}
+        for process_type, finding in findings:
+            correlation_id = case_correlation_id(process_type, finding)
+            if correlation_id in open_cases or correlation_id in new_findings.get(process_type, {}):
+                continue
+            new_findings.setdefault(process_type, {})[correlation_id] = finding
+
+        # The texts of the cases of each process are rendered in one call
+        records = {}
+        for process_type, cases in new_findings.items():
+            texts = render_many(process_type, list(cases.values()))
+            for (correlation_id, finding), (text, subject) in zip(cases.items(), texts):
+                records[correlation_id] = case_record(finding, correlation_id, receiver, text, subject)
+
+        duplicates = len(findings) - len(records)
+        failures = []
+        items = list(records.items())
+        for i in range(0, len(items), self.batch_size):
+            created, failed = self._create(orchestrator_connection, items[i:i + self.batch_size])
+            with self._lock:
+                open_cases.update(created)
+            failures.extend(failed)
+
+        with self._lock:
+            self.stats["created"] += len(records) - len(failures)
+            self.stats["duplicates"] += duplicates
+            self.stats["failed"] += len(failures)
+
+        if failures:
+            raise RuntimeError(f"{len(failures)} ServiceNow cases could not be created: {'; '.join(failures[:5])}")
+        return len(records), duplicates
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return (
+            f"ServiceNow cases: {stats['created']} created in {stats['batches']} batches, "
+            f"{stats['duplicates']} already open, {stats['failed']} failed"
+        )
+
+    def _get_open_cases(self, orchestrator_connection: OrchestratorConnection):
+        """Correlation ids of the open cases created by the robot, listed from ServiceNow on first use"""
+        with self._lock:
+            if self._open_cases is not None:
+                return self._open_cases
+
+        open_cases = set()
+        offset = 0
+        while True:
+            response = service_now_client.request(
+                orchestrator_connection, "GET", self.table_path,
+                params={
+                    "sysparm_query": f"correlation_idSTARTSWITH{CORRELATION_PREFIX}:^active=true",
+                    "sysparm_fields": "correlation_id",
+                    "sysparm_limit": config.SERVICE_NOW_CASE_PAGE_SIZE,
+                    "sysparm_offset": offset,
+                },
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"Could not list open ServiceNow cases. Error {response.status_code}: {response.text}")
+            results = response.json().get("result", [])
+            open_cases.update(result["correlation_id"] for result in results)
+            if len(results) < config.SERVICE_NOW_CASE_PAGE_SIZE:
+                break
+            offset += len(results)
+
+        with self._lock:
+            if self._open_cases is None:
+                self._open_cases = open_cases
+            return self._open_cases
+
+    def _create(self, orchestrator_connection: OrchestratorConnection, items: list[tuple[str, dict]]):
+        """Create the cases of a batch. Returns (created correlation ids, failure messages)"""
+        if self._batch_available:
+            result = self._create_batch(orchestrator_connection, items)
+            if result is not None:
+                return result
+        return self._create_concurrently(orchestrator_connection, items)
+
+    def _create_batch(self, orchestrator_connection: OrchestratorConnection, items: list[tuple[str, dict]]):
+        """Create the cases in one batch API call, or return None if the batch API is not available"""
+        rest_requests = [
+            {
+                "id": str(i),
+                "method": "POST",
+                "url": self.table_path,
+                "headers": [
+                    {"name": "Content-Type", "value": "application/json"},
+                    {"name": "Accept", "value": "application/json"},
+                ],
+                "body": base64.b64encode(json.dumps(record, ensure_ascii=False).encode()).decode(),
+            }
+            for i, (_, record) in enumerate(items)
+        ]
+        response = service_now_client.request(
+            orchestrator_connection, "POST", BATCH_PATH, json={"batch_request_id": "1", "rest_requests": rest_requests}
+        )
+        # Instances without the batch API answer 404 or 405. Other errors fail the batch like any other request
+        if response.status_code in (404, 405):
+            print(f"ServiceNow batch API not available, posting cases one by one: Error {response.status_code}")
+            self._batch_available = False
+            return None
+        if response.status_code != 200:
+            return [], [f"Batch error {response.status_code}: {response.text[:200]}"]
+
+        with self._lock:
+            self.stats["batches"] += 1
+
+        status_per_id = {
+            served["id"]: served.get("status_code")
+            for served in response.json().get("serviced_requests", [])
+        }
+        created, failed = [], []
+        for i, (correlation_id, _) in enumerate(items):
+            status = status_per_id.get(str(i))
+            if status in (200, 201):
+                created.append(correlation_id)
+            else:
+                failed.append(f"{correlation_id}: {status or 'not serviced'}")
+        return created, failed
+
+    def _create_concurrently(self, orchestrator_connection: OrchestratorConnection, items: list[tuple[str, dict]]):
+        """Post the cases one per request, with several requests at the same time"""
+        def post(record):
+            return service_now_client.request(orchestrator_connection, "POST", self.table_path, json=record).status_code
+
+        with ThreadPoolExecutor(max_workers=config.SERVICE_NOW_MAX_CONCURRENT_REQUESTS) as executor:
+            futures = [(correlation_id, executor.submit(post, record)) for correlation_id, record in items]
+
+        created, failed = [], []
+        for correlation_id, future in futures:
+            try:
+                status = future.result()
+            # pylint: disable-next = broad-exception-caught
+            except Exception as e:
+                failed.append(f"{correlation_id}: {str(e)}")
+                continue
+            if status in (200, 201):
+                created.append(correlation_id)
+            else:
+                failed.append(f"{correlation_id}: {status}")
+        return created, failed
+
+
+def case_correlation_id(process_type: str, finding: dict):
+    """Correlation id of the case of a finding. Findings of the same Tjenestenummer and process share a case"""
+    return f"{CORRELATION_PREFIX}:{process_type}:{finding.get('Tjenestenummer')}"
+
+
+def case_record(finding: dict, correlation_id: str, receiver: str | None, text: str, subject: str):
+    """The fields of the case of a finding. The description is the rendered text of the notification e-mail"""
+    record = {
+        "contact_type": "integration",
+        "short_description": f"{subject}: {finding.get('Tjenestenummer')}",
+        "description": html_to_text(text),
+        "correlation_id": correlation_id,
+        "category": "Fejl",
+    }
+    if receiver:
+        record["watch_list"] = receiver
+    return record
+
+
+def html_to_text(text: str):
+    """Plain text of a notification, with a line per paragraph"""
+    text = re.sub(r"<br>|</p>|</h4>", "\n", text)
+    text = re.sub(r"<[^>]+>", "", text)
+    return html.unescape(text).strip()
+
+
+# Shared by the ServiceNow case workers in the robot run
+case_submitter = ServiceNowCaseSubmitter()
@@ -0,0 +1,133 @@
+"""Module for a local on-disk snapshot of reference data, shared by all trigger runs on the machine"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from decimal import Decimal
+
+import pandas as pd
+
+from robot_framework import config
+
+
+class SnapshotStore:
+    """
+    Stores reference data frames in a local SQLite file, keyed by lookup.
+
+    A snapshot checked within `fresh_seconds` is used as is. An older snapshot is used if its
+    fingerprint (e.g. row count and checksum from the server) is unchanged, until it is `max_age` old.
+    Any error in the store is reported and treated as a miss, so the data is loaded from the database.
+    """
+
+    def __init__(self, path: str = config.SNAPSHOT_DB_PATH, fresh_seconds: float = config.SNAPSHOT_FRESH_SECONDS, max_age: float = config.SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.fresh_seconds = fresh_seconds
+        self.max_age = max_age
+        self.stats = {"fresh": 0, "validated": 0, "stale": 0}
+
+    def load(self, key: str, fingerprint=None):
+        """
+        Get the snapshot for `key` if it is still valid.
+
+        Args:
+            key: The snapshot key
+            fingerprint: Callable returning the current fingerprint of the source data, or None to only use the freshness window
+
+        Returns:
+            pd.DataFrame | None: The snapshot, or None if missing or stale
+        """
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT table_name, saved_at, checked_at, fingerprint FROM snapshots WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                table_name, saved_at, checked_at, stored_fingerprint = row
+                now = time.time()
+
+                if now - checked_at <= self.fresh_seconds:
+                    self.stats["fresh"] += 1
+                elif fingerprint and now - saved_at <= self.max_age and fingerprint() == stored_fingerprint:
+                    conn.execute("UPDATE snapshots SET checked_at = ? WHERE key = ?", (now, key))
+                    self.stats["validated"] += 1
+                else:
+                    self.stats["stale"] += 1
+                    return None
+
+                return pd.read_sql(f"SELECT * FROM [{table_name}]", conn)
+
+        except (sqlite3.Error, OSError, pd.errors.DatabaseError) as e:
+            print(f"Snapshot store error, loading from database instead: {str(e)}")
+            return None
+
+    def save(self, key: str, frame: pd.DataFrame, fingerprint_value: str | None = None):
+        """Store `frame` as the snapshot for `key`. The previous snapshot is replaced once the new one is written"""
+        table_name = f"snap_{hashlib.sha256(key.encode()).hexdigest()[:16]}_{time.time_ns()}"
+        try:
+            with self._connect() as conn:
+                _to_storable(frame).to_sql(table_name, conn, index=False)
+                old = conn.execute("SELECT table_name FROM snapshots WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                conn.execute(
+                    "INSERT OR REPLACE INTO snapshots (key, table_name, saved_at, checked_at, fingerprint) VALUES (?, ?, ?, ?, ?)",
+                    (key, table_name, now, now, fingerprint_value)
+                )
+                conn.commit()
+                if old:
+                    conn.execute(f"DROP TABLE IF EXISTS [{old[0]}]")
+                    conn.commit()
+
+        except (sqlite3.Error, OSError, ValueError) as e:
+            print(f"Could not save snapshot: {str(e)}")
+
+    def format_stats(self):
+        """Statistics as a single line for the log"""
+        stats = self.stats
+        return f"Snapshots: {stats['fresh']} fresh, {stats['validated']} validated by fingerprint, {stats['stale']} stale"
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA mmap_size={config.SNAPSHOT_MMAP_SIZE}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots (key TEXT PRIMARY KEY, table_name TEXT, saved_at REAL, checked_at REAL, fingerprint TEXT)"
+        )
+        return _ClosingConnection(conn)
+
+
+class _ClosingConnection:
+    """sqlite3 connections only commit on exit from `with`. This also closes them"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+        finally:
+            self.conn.close()
+
+
+def _to_storable(frame: pd.DataFrame):
+    """SQLite can't store Decimal, which pyodbc returns for numeric columns"""
+    frame = frame.copy()
+    for column in frame.columns[frame.dtypes == object]:
+        if frame[column].map(lambda value: isinstance(value, Decimal)).any():
+            frame[column] = pd.to_numeric(frame[column])
+    return frame
+
+
+def snapshot_key(name: str, arguments: tuple):
+    """Key for a lookup. Arguments are hashed, so connection strings are not stored in the file"""
+    return f"{name}:{hashlib.sha256(repr(arguments).encode()).hexdigest()}"
+
+
+# Shared by all reference data lookups in the robot run
+snapshot_store = SnapshotStore()
@@ -1,5 +1,8 @@
 """Data for KV2 process"""
 
+import re
+from typing import NamedTuple
+
 tillaeg_pairs = [
     {'ovk': 43011, 'pair': (182543, 184171),
      'pair_names': ('BU3011-O-026A-Kompleksitet, adm.l', 'BU3011-O-026B-Kompleksitet, adm.l')},
@@ -78,3 +81,57 @@ tillaeg_pairs = [
     {'ovk': 47501, 'pair': (183513, 183538),
      'pair_names': ('BU7501-O-024A-Selvstændighed/kostplanlæg', 'BU7501-O-024B-Selvstændighed/kostplanlæg')},
 ]
+
+
+# The A/B type of a tillæg is the letter before the last "-" of its name, e.g. "BU3011-O-026A-Kompleksitet, adm.l"
+TILLAEG_TYPE_PATTERN = re.compile(r"([AB])-(?!.*-)")
+
+
+class TillaegPartner(NamedTuple):
+    """The tillæg paired with a tillægsnummer"""
+    number: int
+    name: str
+    type: str
+    ovk: int
+    par_id: int
+    # A/B type of the tillægsnummer itself
+    own_type: str
+
+
+def tillaeg_type(name: str):
+    """The A/B type of a tillæg from its name"""
+    match = TILLAEG_TYPE_PATTERN.search(name)
+    if not match:
+        raise ValueError(f"No A/B type in tillæg name: {name}")
+    return match.group(1)
+
+
+def build_pair_index(pairs: list):
+    """
+    Index the pairs by tillægsnummer, so the partner of a number is a dict lookup.
+    Raises ValueError if a pair is not one A and one B tillæg, or a number is in more than one pair.
+
+    Returns:
+        dict[int, TillaegPartner]
+    """
+    index = {}
+    for par_id, pair in enumerate(pairs):
+        numbers = [int(number) for number in pair["pair"]]
+        names = list(pair["pair_names"])
+        if len(numbers) != 2 or len(names) != 2:
+            raise ValueError(f"Tillæg pair must have two numbers and two names: {pair}")
+
+        types = [tillaeg_type(name) for name in names]
+        if sorted(types) != ["A", "B"]:
+            raise ValueError(f"Tillæg pair must be one A and one B tillæg: {pair}")
+
+        for i, number in enumerate(numbers):
+            if number in index:
+                raise ValueError(f"Tillægsnummer {number} is in more than one pair")
+            other = 1 - i
+            index[number] = TillaegPartner(numbers[other], names[other], types[other], int(pair["ovk"]), par_id, types[i])
+
+    return index
+
+
+tillaeg_index = build_pair_index(tillaeg_pairs)